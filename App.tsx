@@ -96,13 +96,23 @@ const clearSession = () => {
   localStorage.removeItem(SESSION_KEY);
 };
 
+const REPORT_PAGE_SIZE = 100;
+
 const fetchReportList = async (userId: number): Promise<ReportItem[]> => {
-  const response = await fetch(`${API_URL}/reports/${userId}`);
-  const data = await response.json();
-  if (!response.ok) {
-    throw new Error(data?.detail || 'Failed to load history');
-  }
-  return (data.items || []).map((item: { object_key: string; last_modified: string }) => ({
+  const items: { object_key: string; last_modified: string }[] = [];
+  let cursor: string | null = null;
+  do {
+    const params = new URLSearchParams({ limit: String(REPORT_PAGE_SIZE) });
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${API_URL}/reports/${userId}?${params}`);
+    const data = await response.json();
+    if (!response.ok) {
+      throw new Error(data?.detail || 'Failed to load history');
+    }
+    items.push(...(data.items || []));
+    cursor = data.next_cursor || null;
+  } while (cursor);
+  return items.map((item) => ({
     id: item.object_key,
     createdAt: item.last_modified,
     status: 'ready' as const,
@@ -1,28 +1,129 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, EmailStr
 from dotenv import load_dotenv
+import asyncio
+import logging
 import secrets
-import sqlite3
+import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterator
 
 from services.auth_service import hash_password, verify_password
-from services.qwen_service import classify_image
-from services.oss_service import upload_bytes, download_bytes, list_report_objects
-from services.report_service import create_report_payload
+from services.db_service import DATA_DIR, get_connection, get_db_stats
+from services.env_service import env_flag, env_int
+from services.qwen_service import (
+    UNCACHEABLE_REASONS,
+    QwenUnavailableError,
+    classify_image_async,
+    completed_report_fields,
+    get_classify_stats,
+    get_client_stats,
+    get_report_prompt_stats,
+    parse_report_text,
+    stream_report_text,
+)
+from services.oss_service import (
+    copy_object,
+    delete_object,
+    upload_bytes,
+    download_bytes,
+    list_object_keys,
+    get_pool_stats,
+    get_signed_url_stats,
+    get_upload_url,
+    head_object,
+)
+from services.report_service import (
+    analyze_scan,
+    apply_generated_text,
+    build_deterministic_report,
+    correct_and_analyze_urine,
+    create_report_payload,
+    get_report_timing_stats,
+    lookup_cached_narrative,
+    record_report_timings,
+    remember_narrative,
+)
+from services.narrative_cache_service import get_narrative_cache_stats, init_narrative_table
+from services.report_job_service import ReportJob, ReportQueueFullError, get_job, get_job_stats, submit_job
 from services.color_correction_service import correct_image_bytes
+from services.image_worker_service import (
+    ImagePoolBusyError,
+    ImageTaskTimeoutError,
+    get_image_pool_stats,
+    is_saturated,
+    run_image_task,
+    run_image_task_async,
+)
+from services.report_cache_service import (
+    encode_report,
+    get_report as get_cached_report,
+    get_report_cache_stats,
+    get_report_size_stats,
+    record_not_modified,
+    report_body,
+    store_report as cache_report,
+)
+from services.report_index_service import (
+    DEFAULT_PAGE_SIZE,
+    InvalidCursorError,
+    init_reports_table,
+    list_reports as list_indexed_reports,
+    record_report,
+)
+from services.upload_ingest_service import (
+    UploadSizeLimitMiddleware,
+    UploadSpool,
+    UploadTooLargeError,
+    ingest_upload,
+)
+from services.classification_cache_service import (
+    get_cache_stats,
+    init_cache_table,
+    lookup_classification,
+    perceptual_hash,
+    store_classification,
+)
 
 BASE_DIR = Path(__file__).resolve().parent
 load_dotenv(BASE_DIR.parent / ".env")
-DATA_DIR = BASE_DIR / "data"
-DB_PATH = DATA_DIR / "hydrascan.db"
 MAX_UPLOAD_BYTES = 15 * 1024 * 1024  # ~15MB fits typical 12-48MP mobile uploads
+PREVIEW_MAX_BYTES = env_int("UPLOAD_PREVIEW_MAX_BYTES", 1024 * 1024)
+DIRECT_UPLOAD_URL_EXPIRES = env_int("DIRECT_UPLOAD_URL_EXPIRES", 900)
+UPLOAD_TOO_LARGE_DETAIL = "Image exceeds 15MB limit"
+PREVIEW_TOO_LARGE_DETAIL = "Preview image is too large"
 ALLOWED_MIME_TYPES = {"image/jpeg", "image/png", "image/webp"}
 ALLOWED_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+SCAN_TYPES = ("urine", "tongue")
+MAX_JOB_WAIT_SECONDS = 30.0
+EAGER_ANALYSIS = env_flag("EAGER_ANALYSIS", True)
+SPECULATIVE_UPLOAD = env_flag("SPECULATIVE_UPLOAD")
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+# Report inputs (sidecars, images) are independent OSS reads; fetch them side by side.
+_fetch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="report-fetch")
+
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    paths={"/upload-image"},
+    max_body_bytes=MAX_UPLOAD_BYTES,
+    detail=UPLOAD_TOO_LARGE_DETAIL,
+)
+# /upload-confirm only carries the preview; the full image went straight to OSS.
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    paths={"/upload-confirm"},
+    max_body_bytes=PREVIEW_MAX_BYTES,
+    detail=PREVIEW_TOO_LARGE_DETAIL,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
@@ -32,13 +133,6 @@ app.add_middleware(
 )
 
 
-def get_connection() -> sqlite3.Connection:
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
 def init_db() -> None:
     with get_connection() as conn:
         conn.execute(
@@ -52,15 +146,269 @@ def init_db() -> None:
             )
             """
         )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS test_uploads (
+                user_id TEXT NOT NULL,
+                test_id TEXT NOT NULL,
+                scan_type TEXT NOT NULL,
+                object_key TEXT NOT NULL,
+                corrected_key TEXT,
+                analysis_key TEXT,
+                source_id TEXT,
+                updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, test_id, scan_type)
+            )
+            """
+        )
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(test_uploads)")}
+        if "analysis_key" not in columns:
+            conn.execute("ALTER TABLE test_uploads ADD COLUMN analysis_key TEXT")
+        if "source_id" not in columns:
+            conn.execute("ALTER TABLE test_uploads ADD COLUMN source_id TEXT")
         conn.commit()
 
 
+def _record_upload(
+    user_id: str,
+    test_id: str,
+    scan_type: str,
+    object_key: str,
+    corrected_key: str | None,
+    source_id: str | None = None,
+) -> None:
+    # source_id identifies the uploaded image itself (sha256 or PUT ETag); a
+    # retake reuses the same object keys, so the keys alone can't tell them apart.
+    with get_connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO test_uploads (user_id, test_id, scan_type, object_key, corrected_key, source_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, test_id, scan_type) DO UPDATE SET
+                object_key = excluded.object_key,
+                corrected_key = excluded.corrected_key,
+                analysis_key = NULL,
+                source_id = excluded.source_id,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            (user_id, test_id, scan_type, object_key, corrected_key, source_id),
+        )
+        conn.commit()
+
+
+def _attach_corrected_key(
+    user_id: str,
+    test_id: str,
+    scan_type: str,
+    object_key: str,
+    corrected_key: str,
+    source_id: str,
+) -> bool:
+    # For background corrections: only touch the row if it still describes the
+    # upload that was corrected, so a late finish can't clobber a retake.
+    with get_connection() as conn:
+        cursor = conn.execute(
+            """
+            UPDATE test_uploads SET corrected_key = ?, analysis_key = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ? AND test_id = ? AND scan_type = ? AND object_key = ? AND source_id = ?
+            """,
+            (corrected_key, user_id, test_id, scan_type, object_key, source_id),
+        )
+        conn.commit()
+    return cursor.rowcount > 0
+
+
+def _is_current_upload(user_id: str, test_id: str, scan_type: str, source_id: str) -> bool:
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT 1 FROM test_uploads WHERE user_id = ? AND test_id = ? AND scan_type = ? AND source_id = ?",
+            (user_id, test_id, scan_type, source_id),
+        ).fetchone()
+    return row is not None
+
+
+def _record_corrected_key(object_key: str, corrected_key: str) -> None:
+    parts = object_key.split("/")
+    if len(parts) != 4 or parts[2] != "upload":
+        return
+    scan_type = Path(parts[3]).stem.removesuffix("_corrected")
+    if scan_type not in SCAN_TYPES:
+        return
+    _record_upload(parts[0], parts[1], scan_type, object_key, corrected_key)
+
+
+def _record_analysis(
+    user_id: str,
+    test_id: str,
+    scan_type: str,
+    source_key: str,
+    source_id: str,
+    analysis_key: str,
+) -> None:
+    # Only attach the sidecar if the upload it was computed from is still current.
+    with get_connection() as conn:
+        conn.execute(
+            """
+            UPDATE test_uploads SET analysis_key = ?
+            WHERE user_id = ? AND test_id = ? AND scan_type = ?
+                AND COALESCE(corrected_key, object_key) = ? AND source_id = ?
+            """,
+            (analysis_key, user_id, test_id, scan_type, source_key, source_id),
+        )
+        conn.commit()
+
+
+def _load_analysis_keys(user_id: str, test_id: str) -> dict[str, tuple[str, str]]:
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT scan_type, analysis_key, source_id FROM test_uploads
+            WHERE user_id = ? AND test_id = ? AND analysis_key IS NOT NULL AND source_id IS NOT NULL
+            """,
+            (user_id, test_id),
+        ).fetchall()
+    return {row["scan_type"]: (row["analysis_key"], row["source_id"]) for row in rows}
+
+
+def _precompute_analysis(
+    user_id: str,
+    test_id: str,
+    scan_type: str,
+    source_key: str,
+    source_id: str | None,
+    image_bytes: bytes,
+    corrected: bool,
+) -> None:
+    if not source_id:
+        return
+    try:
+        results = run_image_task(analyze_scan, image_bytes, scan_type, corrected)
+    except Exception:
+        return
+    _store_analysis(user_id, test_id, scan_type, source_key, source_id, results)
+
+
+def _store_analysis(
+    user_id: str,
+    test_id: str,
+    scan_type: str,
+    source_key: str,
+    source_id: str | None,
+    results: dict,
+) -> None:
+    if not source_id:
+        return
+    analysis_key = f"{user_id}/{test_id}/analysis/{scan_type}.json"
+    sidecar = {"source_key": source_key, "source_id": source_id, "results": results}
+    try:
+        upload_bytes(analysis_key, json.dumps(sidecar).encode("utf-8"), "application/json")
+    except Exception:
+        return
+    _record_analysis(user_id, test_id, scan_type, source_key, source_id, analysis_key)
+
+
+def _load_precomputed_results(
+    user_id: str,
+    test_id: str,
+    inputs: dict[str, list[str]],
+) -> dict[str, dict]:
+    analysis_keys = {
+        scan_type: entry
+        for scan_type, entry in _load_analysis_keys(user_id, test_id).items()
+        if inputs.get(scan_type)
+    }
+    futures = {
+        scan_type: _fetch_executor.submit(download_bytes, analysis_key)
+        for scan_type, (analysis_key, _) in analysis_keys.items()
+    }
+    precomputed = {}
+    for scan_type, future in futures.items():
+        try:
+            content, _ = future.result()
+            sidecar = json.loads(content.decode("utf-8"))
+        except Exception:
+            continue
+        # A retake writes the same sidecar key, so a slower analysis of the
+        # replaced photo may have overwritten it; only the upload identity
+        # recorded with the current row tells them apart.
+        current_id = analysis_keys[scan_type][1]
+        if (
+            sidecar.get("source_key") == inputs[scan_type][0]
+            and sidecar.get("source_id") == current_id
+            and sidecar.get("results")
+        ):
+            precomputed[scan_type] = sidecar["results"]
+    return precomputed
+
+
+def _load_manifest(user_id: str, test_id: str) -> dict[str, list[str]]:
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT scan_type, object_key, corrected_key FROM test_uploads WHERE user_id = ? AND test_id = ?",
+            (user_id, test_id),
+        ).fetchall()
+    manifest = {}
+    for row in rows:
+        keys = [row["corrected_key"], row["object_key"]]
+        manifest[row["scan_type"]] = [key for key in keys if key]
+    return manifest
+
+
+def _legacy_candidate_names(scan_type: str) -> list[str]:
+    exts = [".jpg", ".jpeg", ".png", ".webp"]
+    return [f"{scan_type}_corrected{ext}" for ext in exts] + [f"{scan_type}{ext}" for ext in exts]
+
+
+def _resolve_test_inputs(user_id: str, test_id: str) -> dict[str, list[str]]:
+    inputs = _load_manifest(user_id, test_id)
+    # Any manifest row means the test was uploaded with the manifest in place,
+    # so a scan type missing from it was simply never uploaded.
+    if inputs:
+        return inputs
+
+    # Tests uploaded before the manifest existed: one prefix listing instead of
+    # probing every candidate key with a GET.
+    prefix = f"{user_id}/{test_id}/upload/"
+    try:
+        existing = set(list_object_keys(prefix))
+    except Exception:
+        return inputs
+    for scan_type in SCAN_TYPES:
+        keys = [f"{prefix}{name}" for name in _legacy_candidate_names(scan_type)]
+        found = [key for key in keys if key in existing]
+        if found:
+            inputs[scan_type] = found
+    return inputs
+
+
+def _download_first(object_keys: list[str]) -> tuple[bytes | None, str | None]:
+    for object_key in object_keys:
+        try:
+            content, _ = download_bytes(object_key)
+        except Exception:
+            continue
+        if content:
+            return content, object_key
+    return None, None
+
+
 def _sanitize_path_part(value: str, label: str) -> str:
     if not value or any(ch not in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-" for ch in value):
         raise HTTPException(status_code=400, detail=f"Invalid {label}")
     return value
 
 
+def _sanitize_report_key(value: str) -> str:
+    # /report only serves generated reports; other objects under a test
+    # (photos, analysis sidecars) must not come back through it or its cache.
+    parts = value.split("/")
+    if len(parts) != 4 or parts[2:] != ["report", "report.json"]:
+        raise HTTPException(status_code=404, detail="Report not found")
+    _sanitize_path_part(parts[0], "user_id")
+    _sanitize_path_part(parts[1], "test_id")
+    return value
+
+
 def _sanitize_object_key(value: str) -> str:
     if not value or value.startswith("/") or ".." in value:
         raise HTTPException(status_code=400, detail="Invalid object key")
@@ -105,12 +453,25 @@ class GenerateReportRequest(BaseModel):
     gender: str | None = None
     height_cm: int | None = None
     weight_kg: int | None = None
+    # Skip the narrative cache and ask the LLM for new text.
+    fresh: bool = False
 
 
 class GenerateReportResponse(BaseModel):
     object_key: str
 
 
+class ReportJobResponse(BaseModel):
+    job_id: str
+    status: str
+    object_key: str | None = None
+    error: str | None = None
+    created_at: float
+    started_at: float | None = None
+    finished_at: float | None = None
+    coalesced: bool = False
+
+
 class ReportListItem(BaseModel):
     object_key: str
     last_modified: str
@@ -118,6 +479,22 @@ class ReportListItem(BaseModel):
 
 class ReportListResponse(BaseModel):
     items: list[ReportListItem]
+    next_cursor: str | None = None
+
+
+class UploadUrlRequest(BaseModel):
+    user_id: str
+    test_id: str
+    content_type: str
+    filename: str | None = None
+
+
+class UploadUrlResponse(BaseModel):
+    upload_url: str
+    object_key: str
+    headers: dict[str, str]
+    expires_in: int
+    max_bytes: int
 
 
 class ColorCorrectRequest(BaseModel):
@@ -129,9 +506,33 @@ class ColorCorrectResponse(BaseModel):
     content_type: str
 
 
+def _image_pool_busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Image processing is at capacity, retry shortly",
+        headers={"Retry-After": "5"},
+    )
+
+
+def _upload_ext(filename: str | None, content_type: str | None) -> str:
+    ext = Path(filename or "").suffix.lower()
+    if ext not in ALLOWED_EXTS:
+        ext = ".jpg" if content_type == "image/jpeg" else ".png" if content_type == "image/png" else ".webp"
+    return ext
+
+
+def _fingerprint_upload(content: memoryview, digest: str) -> tuple[str, int | None]:
+    # The sha256 was computed while the upload streamed in; only the
+    # perceptual hash still needs a decode.
+    return digest, perceptual_hash(content)
+
+
 @app.on_event("startup")
 def startup() -> None:
     init_db()
+    init_cache_table()
+    init_reports_table()
+    init_narrative_table()
 
 
 @app.post("/signup", response_model=AuthResponse)
@@ -172,8 +573,29 @@ def login(payload: LoginRequest) -> AuthResponse:
         )
 
 
+async def _promote_staged_upload(staging_upload: asyncio.Future, staging_key: str, object_key: str) -> bool:
+    try:
+        await staging_upload
+        await run_in_threadpool(copy_object, staging_key, object_key)
+    except Exception:
+        logger.warning("promoting staged upload %s failed; uploading directly", staging_key, exc_info=True)
+        return False
+    return True
+
+
+async def _discard_staged_upload(staging_upload: asyncio.Future | None, staging_key: str) -> None:
+    # Wait for the staging PUT to settle first so the delete cannot race it.
+    if staging_upload is not None:
+        await asyncio.wait([staging_upload])
+    try:
+        await run_in_threadpool(delete_object, staging_key)
+    except Exception:
+        logger.warning("could not delete staged upload %s", staging_key, exc_info=True)
+
+
 @app.post("/upload-image", response_model=ValidateResponse)
 async def upload_image(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     user_id: str = Form(...),
     test_id: str = Form(...),
@@ -181,6 +603,8 @@ async def upload_image(
 ) -> ValidateResponse:
     if file.content_type not in ALLOWED_MIME_TYPES:
         raise HTTPException(status_code=400, detail="Unsupported image type")
+    if is_saturated():
+        raise _image_pool_busy()
 
     user_id = _sanitize_path_part(user_id, "user_id")
     test_id = _sanitize_path_part(test_id, "test_id")
@@ -188,145 +612,523 @@ async def upload_image(
     if scan_type and scan_type not in {"tongue", "urine"}:
         raise HTTPException(status_code=400, detail="Invalid scan type")
 
-    content = await file.read()
-    if len(content) > MAX_UPLOAD_BYTES:
-        raise HTTPException(status_code=413, detail="Image exceeds 15MB limit")
+    try:
+        spool = await ingest_upload(file, MAX_UPLOAD_BYTES)
+    except UploadTooLargeError as exc:
+        raise HTTPException(status_code=413, detail=UPLOAD_TOO_LARGE_DETAIL) from exc
+    try:
+        response = await _accept_upload(spool, background_tasks, file, user_id, test_id, scan_type)
+    except BaseException:
+        spool.close()
+        raise
+    # Background tasks run in order, and before FastAPI closes the UploadFile,
+    # so the eager analysis has read the spool by the time it is released.
+    background_tasks.add_task(spool.close)
+    return response
+
+
+async def _accept_upload(
+    spool: UploadSpool,
+    background_tasks: BackgroundTasks,
+    file: UploadFile,
+    user_id: str,
+    test_id: str,
+    scan_type: str | None,
+) -> ValidateResponse:
+    content = spool.view
+    digest, phash = await run_in_threadpool(_fingerprint_upload, content, spool.sha256)
+    ext = _upload_ext(file.filename, file.content_type)
+
+    staging_key = None
+    staging_upload = None
+    result = await run_in_threadpool(lookup_classification, digest, phash)
+    try:
+        if result is None:
+            if SPECULATIVE_UPLOAD:
+                # Ship the original to a staging key while the VLM call is in flight;
+                # it is promoted if the image is accepted and deleted otherwise.
+                staging_key = f"{user_id}/{test_id}/staging/{secrets.token_hex(8)}{ext}"
+                staging_upload = asyncio.ensure_future(
+                    run_in_threadpool(upload_bytes, staging_key, content, file.content_type)
+                )
+            try:
+                result = await classify_image_async(content, file.content_type)
+            except QwenUnavailableError as exc:
+                raise HTTPException(
+                    status_code=503, detail="Image classification is temporarily unavailable"
+                ) from exc
+            if result.get("reason") not in UNCACHEABLE_REASONS:
+                await run_in_threadpool(store_classification, digest, result, phash)
+        label = result.get("label", "other")
+        reason = result.get("reason", "Unclear image")
+
+        rejection = None
+        if label not in {"tongue", "urine"}:
+            rejection = ValidateResponse(accepted=False, label=label, reason=reason)
+        elif scan_type and label != scan_type:
+            rejection = ValidateResponse(accepted=False, label=label, reason=f"Expected a {scan_type} photo")
+        if rejection is not None:
+            if staging_upload is not None:
+                background_tasks.add_task(_discard_staged_upload, staging_upload, staging_key)
+            return rejection
+
+        object_key = f"{user_id}/{test_id}/upload/{label}{ext}"
+
+        promoted = False
+        if staging_upload is not None:
+            promoted = await _promote_staged_upload(staging_upload, staging_key, object_key)
+            background_tasks.add_task(_discard_staged_upload, None, staging_key)
+        try:
+            if not promoted:
+                await run_in_threadpool(upload_bytes, object_key, content, file.content_type)
+        except Exception as exc:
+            raise HTTPException(status_code=500, detail=f"OSS upload failed: {exc}") from exc
+
+        corrected_key = None
+        corrected_bytes = None
+        urine_results = None
+        if label == "urine":
+            try:
+                corrected_bytes, corrected_content_type, ext, urine_results = await run_image_task_async(
+                    correct_and_analyze_urine,
+                    content,
+                    object_key,
+                    file.content_type,
+                    EAGER_ANALYSIS,
+                )
+                obj_path = Path(object_key)
+                corrected_key = str(obj_path.parent / f"{obj_path.stem}_corrected{ext}")
+                await run_in_threadpool(upload_bytes, corrected_key, corrected_bytes, corrected_content_type)
+            except ImagePoolBusyError as exc:
+                raise _image_pool_busy() from exc
+            except ImageTaskTimeoutError as exc:
+                raise HTTPException(status_code=504, detail="Color correction timed out") from exc
+            except Exception:
+                # Correction failures still accept the original image.
+                corrected_key = object_key
+                corrected_bytes = None
+                urine_results = None
+
+        await run_in_threadpool(
+            _record_upload,
+            user_id,
+            test_id,
+            label,
+            object_key,
+            corrected_key if corrected_key != object_key else None,
+            digest,
+        )
+
+        if EAGER_ANALYSIS and urine_results is not None:
+            # Analysed alongside the correction, from the same decoded frame.
+            background_tasks.add_task(_store_analysis, user_id, test_id, label, corrected_key, digest, urine_results)
+        elif EAGER_ANALYSIS:
+            background_tasks.add_task(
+                _precompute_analysis,
+                user_id,
+                test_id,
+                label,
+                corrected_key if corrected_bytes is not None else object_key,
+                digest,
+                corrected_bytes if corrected_bytes is not None else content,
+                corrected_bytes is not None,
+            )
+
+        return ValidateResponse(
+            accepted=True,
+            label=label,
+            reason="Accepted",
+            object_key=object_key,
+            corrected_key=corrected_key,
+        )
+    except BaseException:
+        # Any failure, cancellation included, leaves nothing to promote, and
+        # background tasks do not run for errors. Shielded so the spool is only
+        # released once the staging PUT has stopped reading it.
+        if staging_upload is not None:
+            await asyncio.shield(_discard_staged_upload(staging_upload, staging_key))
+        raise
+
+
+@app.post("/upload-url", response_model=UploadUrlResponse)
+def create_upload_url(payload: UploadUrlRequest) -> UploadUrlResponse:
+    # Direct-to-OSS flow: the client PUTs the full image to this URL, then
+    # calls /upload-confirm with a small preview for classification.
+    if payload.content_type not in ALLOWED_MIME_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported image type")
+    user_id = _sanitize_path_part(payload.user_id, "user_id")
+    test_id = _sanitize_path_part(payload.test_id, "test_id")
+    ext = _upload_ext(payload.filename, payload.content_type)
+    object_key = f"{user_id}/{test_id}/upload/pending/{secrets.token_hex(8)}{ext}"
+    try:
+        upload_url = get_upload_url(object_key, payload.content_type, DIRECT_UPLOAD_URL_EXPIRES)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"OSS signing failed: {exc}") from exc
+    return UploadUrlResponse(
+        upload_url=upload_url,
+        object_key=object_key,
+        headers={"Content-Type": payload.content_type},
+        expires_in=DIRECT_UPLOAD_URL_EXPIRES,
+        max_bytes=MAX_UPLOAD_BYTES,
+    )
+
+
+@app.post("/upload-confirm", response_model=ValidateResponse)
+async def confirm_upload(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    user_id: str = Form(...),
+    test_id: str = Form(...),
+    object_key: str = Form(...),
+    scan_type: str | None = Form(None),
+) -> ValidateResponse:
+    if file.content_type not in ALLOWED_MIME_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported image type")
+    user_id = _sanitize_path_part(user_id, "user_id")
+    test_id = _sanitize_path_part(test_id, "test_id")
+    if scan_type and scan_type not in {"tongue", "urine"}:
+        raise HTTPException(status_code=400, detail="Invalid scan type")
+    pending_prefix = f"{user_id}/{test_id}/upload/pending/"
+    pending_key = _sanitize_object_key(object_key.strip())
+    if (
+        not pending_key.startswith(pending_prefix)
+        or "/" in pending_key[len(pending_prefix):]
+        or Path(pending_key).suffix not in ALLOWED_EXTS
+    ):
+        raise HTTPException(status_code=400, detail="Invalid object_key")
+
+    try:
+        head = await run_in_threadpool(head_object, pending_key)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"OSS lookup failed: {exc}") from exc
+    if head is None:
+        raise HTTPException(status_code=404, detail="Uploaded image not found")
+    stored_content_type = head["content_type"]
+    if head["size"] > MAX_UPLOAD_BYTES:
+        background_tasks.add_task(_discard_staged_upload, None, pending_key)
+        raise HTTPException(status_code=413, detail=UPLOAD_TOO_LARGE_DETAIL)
 
-    result = classify_image(content, file.content_type)
+    try:
+        preview = await ingest_upload(file, PREVIEW_MAX_BYTES)
+    except UploadTooLargeError as exc:
+        raise HTTPException(status_code=413, detail=PREVIEW_TOO_LARGE_DETAIL) from exc
+    try:
+        content = preview.view
+        digest, phash = await run_in_threadpool(_fingerprint_upload, content, preview.sha256)
+        result = await run_in_threadpool(lookup_classification, digest, phash)
+        if result is None:
+            try:
+                result = await classify_image_async(content, file.content_type)
+            except QwenUnavailableError as exc:
+                raise HTTPException(
+                    status_code=503, detail="Image classification is temporarily unavailable"
+                ) from exc
+            if result.get("reason") not in UNCACHEABLE_REASONS:
+                await run_in_threadpool(store_classification, digest, result, phash)
+    finally:
+        preview.close()
     label = result.get("label", "other")
     reason = result.get("reason", "Unclear image")
 
+    # Rejected images are removed from the bucket; the pending key is never
+    # recorded in the manifest.
     if label not in {"tongue", "urine"}:
+        background_tasks.add_task(_discard_staged_upload, None, pending_key)
         return ValidateResponse(accepted=False, label=label, reason=reason)
-
     if scan_type and label != scan_type:
+        background_tasks.add_task(_discard_staged_upload, None, pending_key)
         return ValidateResponse(accepted=False, label=label, reason=f"Expected a {scan_type} photo")
 
-    ext = Path(file.filename or "").suffix.lower()
-    if ext not in ALLOWED_EXTS:
-        ext = ".jpg" if file.content_type == "image/jpeg" else ".png" if file.content_type == "image/png" else ".webp"
-
-    object_key = f"{user_id}/{test_id}/upload/{label}{ext}"
-
+    final_key = f"{user_id}/{test_id}/upload/{label}{Path(pending_key).suffix}"
     try:
-        upload_bytes(object_key, content, file.content_type)
+        await run_in_threadpool(copy_object, pending_key, final_key)
     except Exception as exc:
-        raise HTTPException(status_code=500, detail=f"OSS upload failed: {exc}") from exc
+        raise HTTPException(status_code=500, detail=f"OSS copy failed: {exc}") from exc
+    background_tasks.add_task(_discard_staged_upload, None, pending_key)
+    # The direct upload is never hashed here; the ETag of its PUT identifies it.
+    source_id = head.get("etag") or secrets.token_hex(16)
+    await run_in_threadpool(_record_upload, user_id, test_id, label, final_key, None, source_id)
+    background_tasks.add_task(
+        _finalize_direct_upload,
+        user_id,
+        test_id,
+        label,
+        final_key,
+        stored_content_type or file.content_type,
+        source_id,
+    )
+
+    # corrected_key is filled into the manifest once the background correction lands.
+    return ValidateResponse(accepted=True, label=label, reason="Accepted", object_key=final_key)
+
+
+def _finalize_direct_upload(
+    user_id: str,
+    test_id: str,
+    label: str,
+    object_key: str,
+    content_type: str,
+    source_id: str,
+) -> None:
+    # Correction and eager analysis need the full image, which only the bucket
+    # has; pull it once after the response has gone out.
+    if label != "urine" and not EAGER_ANALYSIS:
+        return
+    try:
+        content, _ = download_bytes(object_key)
+    except Exception:
+        logger.warning("could not fetch direct upload %s", object_key, exc_info=True)
+        return
 
-    corrected_key = None
+    source_key, source_bytes, corrected = object_key, content, False
+    urine_results = None
     if label == "urine":
         try:
-            corrected_bytes, corrected_content_type, ext = correct_image_bytes(
+            corrected_bytes, corrected_content_type, ext, urine_results = run_image_task(
+                correct_and_analyze_urine,
                 content,
-                object_key=object_key,
-                content_type=file.content_type,
+                object_key,
+                content_type,
+                EAGER_ANALYSIS,
             )
             obj_path = Path(object_key)
             corrected_key = str(obj_path.parent / f"{obj_path.stem}_corrected{ext}")
+            # Retaken meanwhile: the corrected key may now belong to the new photo.
+            if not _is_current_upload(user_id, test_id, label, source_id):
+                return
             upload_bytes(corrected_key, corrected_bytes, corrected_content_type)
+            if not _attach_corrected_key(user_id, test_id, label, object_key, corrected_key, source_id):
+                return
+            source_key, source_bytes, corrected = corrected_key, corrected_bytes, True
         except Exception:
-            corrected_key = object_key
+            logger.warning("background correction of %s failed", object_key, exc_info=True)
+            urine_results = None
+
+    if EAGER_ANALYSIS and urine_results is not None and corrected:
+        _store_analysis(user_id, test_id, label, source_key, source_id, urine_results)
+    elif EAGER_ANALYSIS:
+        _precompute_analysis(user_id, test_id, label, source_key, source_id, source_bytes, corrected)
+
+
+def _collect_report_inputs(user_id: str, test_id: str, timings: dict[str, float] | None = None) -> dict:
+    started = time.perf_counter()
+    inputs = _resolve_test_inputs(user_id, test_id)
+    precomputed = _load_precomputed_results(user_id, test_id, inputs)
+    downloads = {
+        scan_type: _fetch_executor.submit(_download_first, inputs.get(scan_type, []))
+        for scan_type in SCAN_TYPES
+        if scan_type not in precomputed
+    }
+    urine_bytes, urine_key = downloads["urine"].result() if "urine" in downloads else (None, None)
+    tongue_bytes, _ = downloads["tongue"].result() if "tongue" in downloads else (None, None)
+    if timings is not None:
+        timings["inputs"] = round((time.perf_counter() - started) * 1000, 1)
+
+    return {
+        "urine_bytes": urine_bytes,
+        "tongue_bytes": tongue_bytes,
+        "urine_corrected": bool(urine_key and Path(urine_key).stem.endswith("_corrected")),
+        "urine_results": precomputed.get("urine"),
+        "tongue_results": precomputed.get("tongue"),
+    }
 
-    return ValidateResponse(
-        accepted=True,
-        label=label,
-        reason="Accepted",
-        object_key=object_key,
-        corrected_key=corrected_key,
-    )
 
+def _build_report(
+    user_id: str,
+    test_id: str,
+    profile: dict,
+    timings: dict[str, float] | None = None,
+    fresh: bool = False,
+) -> dict:
+    inputs = _collect_report_inputs(user_id, test_id, timings)
+    return create_report_payload(user_profile=profile, timings=timings, fresh_narrative=fresh, **inputs)
 
-@app.post("/generate-report", response_model=GenerateReportResponse)
-def generate_report(payload: GenerateReportRequest) -> GenerateReportResponse:
-    user_id = _sanitize_path_part(payload.user_id, "user_id")
-    test_id = _sanitize_path_part(payload.test_id, "test_id")
 
-    urine_bytes = None
-    candidates = [
-        "urine_corrected.jpg",
-        "urine_corrected.jpeg",
-        "urine_corrected.png",
-        "urine_corrected.webp",
-        "urine.jpg",
-        "urine.jpeg",
-        "urine.png",
-        "urine.webp",
-    ]
-    for name in candidates:
-        object_key = f"{user_id}/{test_id}/upload/{name}"
-        try:
-            urine_bytes, _ = download_bytes(object_key)
-            if urine_bytes:
-                break
-        except Exception:
-            continue
+def _log_report_timings(user_id: str, test_id: str, timings: dict[str, float], started: float) -> None:
+    timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+    record_report_timings(timings)
+    stages = " ".join(f"{stage}={value}ms" for stage, value in timings.items())
+    logger.info("report %s/%s generated: %s", user_id, test_id, stages)
 
-    tongue_bytes = None
-    tongue_candidates = [
-        "tongue_corrected.jpg",
-        "tongue_corrected.jpeg",
-        "tongue_corrected.png",
-        "tongue_corrected.webp",
-        "tongue.jpg",
-        "tongue.jpeg",
-        "tongue.png",
-        "tongue.webp",
-    ]
-    for name in tongue_candidates:
-        object_key = f"{user_id}/{test_id}/upload/{name}"
-        try:
-            tongue_bytes, _ = download_bytes(object_key)
-            if tongue_bytes:
-                break
-        except Exception:
-            continue
 
-    profile = {
+def _store_report(user_id: str, test_id: str, report: dict) -> str:
+    content = json.dumps(report, ensure_ascii=False).encode("utf-8")
+    object_key = f"{user_id}/{test_id}/report/report.json"
+    stored, encoding = encode_report(content)
+    etag = upload_bytes(object_key, stored, "application/json", encoding)
+    cache_report(object_key, etag, stored, encoding)
+    try:
+        record_report(user_id, test_id, object_key)
+    except Exception:
+        # The report is stored; a missed index row is repaired by the backfill.
+        logger.warning("could not index report %s", object_key, exc_info=True)
+    return object_key
+
+
+def _profile_from_request(payload: GenerateReportRequest) -> dict:
+    return {
         "age": payload.age,
         "gender": payload.gender,
         "height_cm": payload.height_cm,
         "weight_kg": payload.weight_kg,
     }
-    report = create_report_payload(
-        urine_bytes=urine_bytes,
-        tongue_bytes=tongue_bytes,
-        user_profile=profile,
-    )
-    content = json.dumps(report, ensure_ascii=False).encode("utf-8")
-    object_key = f"{user_id}/{test_id}/report/report.json"
 
+
+def _run_report_job(user_id: str, test_id: str, profile: dict, fresh: bool = False) -> str:
+    started = time.perf_counter()
+    timings: dict[str, float] = {}
+    report = _build_report(user_id, test_id, profile, timings, fresh)
     try:
-        upload_bytes(object_key, content, "application/json")
+        object_key = _store_report(user_id, test_id, report)
+    except Exception as exc:
+        raise RuntimeError(f"OSS upload failed: {exc}") from exc
+    _log_report_timings(user_id, test_id, timings, started)
+    return object_key
+
+
+def _job_response(job: ReportJob, coalesced: bool = False) -> ReportJobResponse:
+    return ReportJobResponse(**job.to_dict(), coalesced=coalesced)
+
+
+@app.post("/generate-report", response_model=GenerateReportResponse)
+def generate_report(payload: GenerateReportRequest) -> GenerateReportResponse:
+    user_id = _sanitize_path_part(payload.user_id, "user_id")
+    test_id = _sanitize_path_part(payload.test_id, "test_id")
+
+    started = time.perf_counter()
+    timings: dict[str, float] = {}
+    try:
+        report = _build_report(user_id, test_id, _profile_from_request(payload), timings, payload.fresh)
+    except ImagePoolBusyError as exc:
+        raise _image_pool_busy() from exc
+    except ImageTaskTimeoutError as exc:
+        raise HTTPException(status_code=504, detail="Image analysis timed out") from exc
+
+    try:
+        object_key = _store_report(user_id, test_id, report)
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"OSS upload failed: {exc}") from exc
 
+    _log_report_timings(user_id, test_id, timings, started)
     return GenerateReportResponse(object_key=object_key)
 
 
+def _sse(event: str, data: object) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _stream_report_events(user_id: str, test_id: str, profile: dict, fresh: bool = False) -> Iterator[str]:
+    # Deterministic parts first (metrics, summary, drinks), then each LLM field as
+    # soon as its value is complete, then the persisted report.
+    started = time.perf_counter()
+    timings: dict[str, float] = {}
+    try:
+        inputs = _collect_report_inputs(user_id, test_id, timings)
+        report = build_deterministic_report(user_profile=profile, timings=timings, **inputs)
+        yield _sse("report", report)
+        llm_started = time.perf_counter()
+
+        signature, generated = lookup_cached_narrative(report, fresh)
+        if generated is not None:
+            for name, value in generated.items():
+                yield _sse("field", {"name": name, "value": value})
+        else:
+            text = ""
+            sent: set[str] = set()
+            for delta in stream_report_text(report):
+                text += delta
+                for name, value in completed_report_fields(text).items():
+                    if name not in sent:
+                        sent.add(name)
+                        yield _sse("field", {"name": name, "value": value})
+            generated = parse_report_text(text) if text else None
+            remember_narrative(signature, generated)
+
+        apply_generated_text(report, generated)
+        timings["llm"] = round((time.perf_counter() - llm_started) * 1000, 1)
+        object_key = _store_report(user_id, test_id, report)
+    except Exception as exc:
+        yield _sse("error", {"detail": str(exc) or exc.__class__.__name__})
+        return
+    _log_report_timings(user_id, test_id, timings, started)
+    yield _sse("complete", {"object_key": object_key, "report": report})
+
+
+@app.post("/generate-report/stream")
+def generate_report_stream(payload: GenerateReportRequest) -> StreamingResponse:
+    user_id = _sanitize_path_part(payload.user_id, "user_id")
+    test_id = _sanitize_path_part(payload.test_id, "test_id")
+    return StreamingResponse(
+        _stream_report_events(user_id, test_id, _profile_from_request(payload), payload.fresh),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/report-jobs", response_model=ReportJobResponse, status_code=202)
+def create_report_job(payload: GenerateReportRequest) -> ReportJobResponse:
+    user_id = _sanitize_path_part(payload.user_id, "user_id")
+    test_id = _sanitize_path_part(payload.test_id, "test_id")
+    try:
+        job, coalesced = submit_job(
+            f"{user_id}/{test_id}",
+            _run_report_job,
+            user_id,
+            test_id,
+            _profile_from_request(payload),
+            payload.fresh,
+        )
+    except ReportQueueFullError as exc:
+        raise HTTPException(status_code=503, detail="Report queue is full, retry later") from exc
+    return _job_response(job, coalesced)
+
+
+@app.get("/report-jobs/{job_id}", response_model=ReportJobResponse)
+async def get_report_job(job_id: str, wait: float = 0) -> ReportJobResponse:
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    # Long-poll without pinning a worker thread: poll the completion flag from the loop.
+    deadline = time.monotonic() + min(max(wait, 0.0), MAX_JOB_WAIT_SECONDS)
+    while not job.done.is_set() and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    return _job_response(job)
+
+
 @app.get("/reports/{user_id}", response_model=ReportListResponse)
-def list_reports(user_id: str) -> ReportListResponse:
+def list_reports(user_id: str, cursor: str | None = None, limit: int | None = None) -> ReportListResponse:
     user_id = _sanitize_path_part(user_id, "user_id")
+    # Paging is opt-in: without limit or cursor the full history is returned.
+    if limit is None and cursor is not None:
+        limit = DEFAULT_PAGE_SIZE
     try:
-        items = list_report_objects(user_id)
-    except Exception as exc:
-        raise HTTPException(status_code=500, detail=f"OSS list failed: {exc}") from exc
-    return ReportListResponse(items=[ReportListItem(**item) for item in items])
+        items, next_cursor = list_indexed_reports(user_id, cursor, limit)
+    except InvalidCursorError as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+    return ReportListResponse(items=[ReportListItem(**item) for item in items], next_cursor=next_cursor)
 
 
 @app.post("/correct-urine-color", response_model=ColorCorrectResponse)
 def correct_urine_color(payload: ColorCorrectRequest) -> ColorCorrectResponse:
     object_key = _sanitize_object_key(payload.object_key.strip())
+    if is_saturated():
+        raise _image_pool_busy()
     try:
         content, content_type = download_bytes(object_key)
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"OSS download failed: {exc}") from exc
 
     try:
-        corrected_bytes, out_content_type, ext = correct_image_bytes(
+        corrected_bytes, out_content_type, ext = run_image_task(
+            correct_image_bytes,
             content,
-            object_key=object_key,
-            content_type=content_type,
+            object_key,
+            content_type,
         )
+    except ImagePoolBusyError as exc:
+        raise _image_pool_busy() from exc
+    except ImageTaskTimeoutError as exc:
+        raise HTTPException(status_code=504, detail="Color correction timed out") from exc
     except Exception as exc:
         raise HTTPException(status_code=400, detail=f"Color correction failed: {exc}") from exc
 
@@ -337,9 +1139,30 @@ def correct_urine_color(payload: ColorCorrectRequest) -> ColorCorrectResponse:
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"OSS upload failed: {exc}") from exc
 
+    _record_corrected_key(object_key, corrected_key)
+
     return ColorCorrectResponse(corrected_key=corrected_key, content_type=out_content_type)
 
 
+@app.get("/metrics")
+def get_metrics():
+    return {
+        "oss_pool": get_pool_stats(),
+        "signed_urls": get_signed_url_stats(),
+        "qwen_client": get_client_stats(),
+        "classification": get_classify_stats(),
+        "classification_cache": get_cache_stats(),
+        "report_jobs": get_job_stats(),
+        "report_timings": get_report_timing_stats(),
+        "image_pool": get_image_pool_stats(),
+        "report_cache": get_report_cache_stats(),
+        "report_size": get_report_size_stats(),
+        "narrative_cache": get_narrative_cache_stats(),
+        "report_prompt": get_report_prompt_stats(),
+        "sqlite": get_db_stats(),
+    }
+
+
 @app.get("/overview")
 def get_overview():
     file_path = DATA_DIR / "overview.json"
@@ -355,13 +1178,33 @@ def get_report():
 
 
 @app.get("/report/{object_key:path}")
-def get_report_from_oss(object_key: str):
-    object_key = _sanitize_object_key(object_key)
+def get_report_from_oss(object_key: str, request: Request):
+    object_key = _sanitize_report_key(object_key)
     try:
-        content, _ = download_bytes(object_key)
+        entry = get_cached_report(object_key)
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"OSS download failed: {exc}") from exc
+
+    etag = f'"{entry.etag}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+        record_not_modified()
+        return Response(status_code=304, headers=headers)
+    # Stored reports are already JSON (gzipped or not); pass the bytes through.
     try:
-        return json.loads(content.decode("utf-8"))
-    except json.JSONDecodeError as exc:
-        raise HTTPException(status_code=500, detail="Report JSON invalid") from exc
+        content, encoding = report_body(entry, request.headers.get("accept-encoding"))
+    except (OSError, EOFError) as exc:
+        raise HTTPException(status_code=500, detail="Stored report is corrupt") from exc
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/").strip('"') == etag:
+            return True
+    return False
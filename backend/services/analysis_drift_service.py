@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+from services.image_pipeline_service import ANALYSIS_SCALES
+from services.tongue_analysis_service import analyze_tongue_health_bytes
+from services.urine_analysis_service import analyze_urine_hydration_bytes
+
+# Metrics that drive the report text; drift is measured against a full-size decode.
+DRIFT_METRICS = {
+    "urine": ("b_star",),
+    "tongue": ("coating_percentage", "moisture_score"),
+}
+DEFAULT_TOLERANCES = {
+    "b_star": 1.0,
+    "coating_percentage": 2.0,
+    "moisture_score": 1.0,
+}
+
+
+def _analyze(scan_type: str, image_bytes: bytes, scale: int) -> dict[str, Any]:
+    if scan_type == "urine":
+        return analyze_urine_hydration_bytes(image_bytes, scale=scale)
+    return analyze_tongue_health_bytes(image_bytes, scale=scale)
+
+
+def measure_scale_drift(
+    scan_type: str,
+    image_bytes: bytes,
+    scales: tuple[int, ...] = ANALYSIS_SCALES,
+) -> dict[int, dict[str, Any]]:
+    if scan_type not in DRIFT_METRICS:
+        raise ValueError(f"Unknown scan type: {scan_type}")
+    rows: dict[int, dict[str, Any]] = {}
+    baseline: dict[str, Any] | None = None
+    for scale in sorted(set(scales) | {1}):
+        started = time.perf_counter()
+        try:
+            metrics = _analyze(scan_type, image_bytes, scale)["metrics"]
+        except ValueError as exc:
+            # Without the full-size baseline there is nothing to compare against.
+            if baseline is None:
+                raise
+            rows[scale] = {"error": str(exc)}
+            continue
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if baseline is None:
+            baseline = metrics
+        row = {"ms": round(elapsed_ms, 1)}
+        for name in DRIFT_METRICS[scan_type]:
+            row[name] = metrics[name]
+            row[f"{name}_drift"] = round(abs(metrics[name] - baseline[name]), 2)
+        rows[scale] = row
+    return rows
+
+
+def largest_scale_within_tolerance(
+    drift_by_file: list[dict[int, dict[str, Any]]],
+    tolerances: dict[str, float] = DEFAULT_TOLERANCES,
+) -> int | None:
+    if not drift_by_file:
+        return None
+    best = 1
+    for scale in ANALYSIS_SCALES:
+        for drift in drift_by_file:
+            row = drift.get(scale, {})
+            # A scale the analysis could not handle at all is out of tolerance.
+            if "error" in row:
+                return best
+            if any(row.get(f"{name}_drift", 0.0) > limit for name, limit in tolerances.items()):
+                return best
+        best = scale
+    return best
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Compare analysis metrics at reduced decode scales against full resolution.",
+    )
+    parser.add_argument("--urine", nargs="*", default=[], type=Path, help="urine sample images")
+    parser.add_argument("--tongue", nargs="*", default=[], type=Path, help="tongue sample images")
+    for name, default in DEFAULT_TOLERANCES.items():
+        parser.add_argument(f"--max-{name.replace('_', '-')}", type=float, default=default)
+    args = parser.parse_args(argv)
+    if not args.urine and not args.tongue:
+        parser.error("pass at least one --urine or --tongue image")
+
+    tolerances = {name: getattr(args, f"max_{name}") for name in DEFAULT_TOLERANCES}
+    drifts: list[dict[int, dict[str, Any]]] = []
+    for scan_type, paths in (("urine", args.urine), ("tongue", args.tongue)):
+        for path in paths:
+            try:
+                drift = measure_scale_drift(scan_type, path.read_bytes())
+            except (OSError, ValueError) as exc:
+                print(f"{path}: skipped ({exc})", file=sys.stderr)
+                continue
+            drifts.append(drift)
+            print(json.dumps({"file": str(path), "scan_type": scan_type, "scales": drift}))
+
+    scale = largest_scale_within_tolerance(drifts, tolerances)
+    if scale is None:
+        print("no image could be analysed at full size; no recommendation", file=sys.stderr)
+        return 1
+    print(f"largest ANALYSIS_SCALE within tolerance: {scale}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Callable, ContextManager
+
+from services import db_service
+from services.auth_service import hash_password, verify_password
+
+USERS_TABLE = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        email TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+PASSWORD = "benchmark-password"
+
+
+def _legacy_connection(path: Path) -> ContextManager[sqlite3.Connection]:
+    # What /signup and /login did before the pool: mkdir plus a fresh
+    # connection per request with the default rollback journal.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return closing(conn)
+
+
+def _pooled_connection(path: Path) -> ContextManager[sqlite3.Connection]:
+    # get_connection keys its per-thread connection on the path, so pointing
+    # the module at the scratch database is enough for a standalone run.
+    db_service.DB_PATH = path
+    return db_service.get_connection()
+
+
+def _signup(connect: Callable[[], ContextManager[sqlite3.Connection]], email: str, password_hash: str | None) -> None:
+    with connect() as conn:
+        existing = conn.execute("SELECT id FROM users WHERE email = ?", (email,)).fetchone()
+        if existing:
+            raise ValueError(f"{email} already registered")
+        if password_hash is None:
+            password_hash = hash_password(PASSWORD)
+        conn.execute(
+            "INSERT INTO users (name, email, password_hash) VALUES (?, ?, ?)",
+            ("Bench", email, password_hash),
+        )
+        conn.commit()
+
+
+def _login(connect: Callable[[], ContextManager[sqlite3.Connection]], email: str, hash_passwords: bool) -> None:
+    with connect() as conn:
+        row = conn.execute(
+            "SELECT id, name, email, password_hash FROM users WHERE email = ?",
+            (email,),
+        ).fetchone()
+    if not row or (hash_passwords and not verify_password(PASSWORD, row["password_hash"])):
+        raise ValueError(f"login failed for {email}")
+
+
+def _timed(fn: Callable[..., None], *args: Any) -> tuple[float, str | None]:
+    started = time.perf_counter()
+    try:
+        fn(*args)
+    except (sqlite3.Error, ValueError) as exc:
+        return (time.perf_counter() - started) * 1000, str(exc)
+    return (time.perf_counter() - started) * 1000, None
+
+
+def _phase(pool: ThreadPoolExecutor, fn: Callable[..., None], calls: list[tuple[Any, ...]]) -> dict[str, Any]:
+    started = time.perf_counter()
+    results = list(pool.map(lambda args: _timed(fn, *args), calls))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(ms for ms, _ in results)
+    errors = [error for _, error in results if error]
+    return {
+        "ops_per_s": round(len(calls) / elapsed, 1) if elapsed else None,
+        "ms_p50": round(statistics.median(latencies), 2),
+        "ms_p95": round(latencies[int(0.95 * (len(latencies) - 1))], 2),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+    }
+
+
+def run_mode(mode: str, operations: int, concurrency: int, hash_passwords: bool) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "data" / "hydrascan.db"
+        if mode == "legacy":
+            def connect() -> ContextManager[sqlite3.Connection]:
+                return _legacy_connection(path)
+        else:
+            def connect() -> ContextManager[sqlite3.Connection]:
+                return _pooled_connection(path)
+        with connect() as conn:
+            conn.execute(USERS_TABLE)
+            conn.commit()
+
+        # Hashing is CPU work that dwarfs the database time; by default one
+        # precomputed hash is reused so the comparison isolates the store.
+        fixed_hash = None if hash_passwords else hash_password(PASSWORD)
+        emails = [f"bench{i}@example.com" for i in range(operations)]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            signup = _phase(pool, _signup, [(connect, email, fixed_hash) for email in emails])
+            login = _phase(pool, _login, [(connect, email, hash_passwords) for email in emails])
+    return {"mode": mode, "signup": signup, "login": login}
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Compare signup/login throughput on per-call rollback-journal connections and the WAL pool.",
+    )
+    parser.add_argument("--operations", type=int, default=500, help="signups (then logins) per mode")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent request threads")
+    parser.add_argument(
+        "--hash-passwords",
+        action="store_true",
+        help="include PBKDF2 hashing as the real endpoints do (CPU bound, masks the store)",
+    )
+    args = parser.parse_args(argv)
+    if args.operations < 1 or args.concurrency < 1:
+        parser.error("--operations and --concurrency must be at least 1")
+
+    rows = []
+    for mode in ("legacy", "pooled"):
+        row = run_mode(mode, args.operations, args.concurrency, args.hash_passwords)
+        rows.append(row)
+        print(json.dumps(row))
+
+    failed = sum(row[phase]["errors"] for row in rows for phase in ("signup", "login"))
+    if failed:
+        print(f"{failed} operations failed; see first_error", file=sys.stderr)
+    legacy, pooled = rows
+    for phase in ("signup", "login"):
+        before, after = legacy[phase]["ops_per_s"], pooled[phase]["ops_per_s"]
+        print(f"{phase}: {before} -> {after} ops/s at concurrency {args.concurrency}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
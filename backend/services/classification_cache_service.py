@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import time
+
+import cv2
+import numpy as np
+
+from services.db_service import get_connection
+from services.env_service import env_flag, env_int
+from services.ttl_cache_service import TTLCache
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL_SECONDS = 24 * 3600
+
+
+def _cache_size() -> int:
+    return max(0, env_int("CLASSIFY_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+
+
+# The perceptual hash rides along as the entry tag for near-duplicate matches.
+_cache = TTLCache(_cache_size, counters=("near_duplicate_hits",))
+
+
+def _cache_ttl() -> int:
+    return max(0, env_int("CLASSIFY_CACHE_TTL_SECONDS", DEFAULT_CACHE_TTL_SECONDS))
+
+
+def _phash_distance() -> int:
+    return env_int("CLASSIFY_CACHE_PHASH_DISTANCE", 0)
+
+
+def _sqlite_enabled() -> bool:
+    return env_flag("CLASSIFY_CACHE_SQLITE")
+
+
+def init_cache_table() -> None:
+    with get_connection() as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS classification_cache (
+                content_hash TEXT PRIMARY KEY,
+                label TEXT NOT NULL,
+                reason TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        conn.commit()
+
+
+def perceptual_hash(image_bytes: bytes) -> int | None:
+    # 64-bit difference hash; recompressed or resized copies of the same
+    # photo land within a few bits of each other.
+    if _phash_distance() <= 0:
+        return None
+    data = np.frombuffer(image_bytes, dtype=np.uint8)
+    gray = cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        return None
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def lookup_classification(digest: str, phash: int | None = None) -> dict[str, str] | None:
+    ttl = _cache_ttl()
+    max_distance = _phash_distance()
+
+    def near(other: int) -> bool:
+        return (phash ^ other).bit_count() <= max_distance
+
+    def load(now: float) -> tuple[dict[str, str], float] | None:
+        if not _sqlite_enabled() or ttl <= 0:
+            return None
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT label, reason FROM classification_cache WHERE content_hash = ? AND created_at > ?",
+                (digest, now - ttl),
+            ).fetchone()
+        if not row:
+            return None
+        return {"label": row["label"], "reason": row["reason"]}, now + ttl
+
+    use_near = phash is not None and max_distance > 0
+    return _cache.lookup(digest, load=load, near=near if use_near else None)
+
+
+def store_classification(digest: str, result: dict[str, str], phash: int | None = None) -> None:
+    ttl = _cache_ttl()
+    if ttl <= 0:
+        return
+    now = time.time()
+    _cache.store(digest, result, now + ttl, tag=phash)
+    if _sqlite_enabled():
+        with get_connection() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO classification_cache (content_hash, label, reason, created_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                (digest, result.get("label", "other"), result.get("reason", ""), now),
+            )
+            conn.execute("DELETE FROM classification_cache WHERE created_at <= ?", (now - ttl,))
+            conn.commit()
+
+
+def get_cache_stats() -> dict[str, float]:
+    return _cache.stats()
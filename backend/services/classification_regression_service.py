@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import argparse
+import json
+import mimetypes
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+from services.db_service import BASE_DIR
+from services.qwen_service import classify_image, prepare_image_for_vlm
+
+
+def compare_labels(image_bytes: bytes, mime_type: str) -> dict[str, Any]:
+    # One call with the original bytes, one with the downscaled/re-encoded
+    # payload that classify_image sends by default.
+    row: dict[str, Any] = {"bytes_in": len(image_bytes)}
+    payload, _, preprocessed = prepare_image_for_vlm(image_bytes, mime_type)
+    row["bytes_sent"] = len(payload) if preprocessed else len(image_bytes)
+    for mode, preprocess in (("raw", False), ("preprocessed", True)):
+        started = time.perf_counter()
+        result = classify_image(image_bytes, mime_type, preprocess=preprocess)
+        row[f"{mode}_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        row[mode] = result["label"]
+    row["match"] = row["raw"] == row["preprocessed"]
+    return row
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Check that VLM labels do not change when images are preprocessed before classification.",
+    )
+    parser.add_argument("--urine", nargs="*", default=[], type=Path, help="urine sample images")
+    parser.add_argument("--tongue", nargs="*", default=[], type=Path, help="tongue sample images")
+    parser.add_argument("--other", nargs="*", default=[], type=Path, help="images that should be rejected")
+    args = parser.parse_args(argv)
+    if not args.urine and not args.tongue and not args.other:
+        parser.error("pass at least one --urine, --tongue or --other image")
+    if not os.getenv("DASHSCOPE_API_KEY", "").strip():
+        parser.error("DASHSCOPE_API_KEY must be set")
+
+    checked = mismatches = wrong = 0
+    for expected, paths in (("urine", args.urine), ("tongue", args.tongue), ("other", args.other)):
+        for path in paths:
+            try:
+                image_bytes = path.read_bytes()
+                row = compare_labels(image_bytes, mimetypes.guess_type(path.name)[0] or "image/jpeg")
+            except Exception as exc:
+                print(f"{path}: skipped ({exc})", file=sys.stderr)
+                continue
+            checked += 1
+            mismatches += not row["match"]
+            wrong += row["preprocessed"] != expected
+            print(json.dumps({"file": str(path), "expected": expected, **row}))
+
+    if not checked:
+        print("no image could be classified; nothing to compare", file=sys.stderr)
+        return 1
+    print(f"{checked} images: {mismatches} label changes after preprocessing, {wrong} not labelled as expected")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv(BASE_DIR.parent / ".env")
+    raise SystemExit(main())
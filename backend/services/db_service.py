@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from services.env_service import env_int
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = BASE_DIR / "data"
+DB_PATH = DATA_DIR / "hydrascan.db"
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+DEFAULT_CACHED_STATEMENTS = 256
+
+_local = threading.local()
+_lock = threading.Lock()
+_prepared_dirs: set[Path] = set()
+_stats = {"opened": 0, "reused": 0}
+
+
+def _journal_mode() -> str:
+    value = os.getenv("SQLITE_JOURNAL_MODE", "wal").strip().lower()
+    return value if value in {"wal", "delete"} else "wal"
+
+
+def _open(path: Path) -> sqlite3.Connection:
+    with _lock:
+        if path.parent not in _prepared_dirs:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _prepared_dirs.add(path.parent)
+    # timeout is sqlite3's busy timeout: wait this long for a lock before
+    # raising "database is locked".
+    conn = sqlite3.connect(
+        path,
+        timeout=max(0, env_int("SQLITE_BUSY_TIMEOUT_MS", DEFAULT_BUSY_TIMEOUT_MS)) / 1000,
+        cached_statements=max(0, env_int("SQLITE_CACHED_STATEMENTS", DEFAULT_CACHED_STATEMENTS)),
+    )
+    conn.row_factory = sqlite3.Row
+    # WAL lets readers run alongside the single writer, and NORMAL only syncs
+    # at checkpoints, which is still crash-safe in WAL mode.
+    conn.execute(f"PRAGMA journal_mode={_journal_mode()}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    # One long-lived connection per thread (and process) instead of a new one
+    # per call; callers keep using it as a transaction context manager, which
+    # commits or rolls back but leaves the connection open for reuse.
+    path = Path(DB_PATH)
+    owner = (os.getpid(), path)
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "owner", None) == owner:
+        with _lock:
+            _stats["reused"] += 1
+        return conn
+    conn = _open(path)
+    _local.conn, _local.owner = conn, owner
+    with _lock:
+        _stats["opened"] += 1
+    return conn
+
+
+def get_db_stats() -> dict[str, object]:
+    with _lock:
+        stats: dict[str, object] = dict(_stats)
+    stats["journal_mode"] = _journal_mode()
+    return stats
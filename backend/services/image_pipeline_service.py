@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import cv2
+import numpy as np
+
+from services.env_service import env_int
+
+ANALYSIS_SCALES = (1, 2, 4, 8)
+# libjpeg can skip IDCT work and emit the image at 1/2, 1/4 or 1/8 size directly.
+_REDUCED_JPEG_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def _white_balance_luts(image: np.ndarray) -> np.ndarray:
+    # cv2.mean accumulates straight from the uint8 buffer, so no float copy
+    # of the frame is made just to get the three channel averages.
+    avg_b, avg_g, avg_r = cv2.mean(image)[:3]
+    avg_gray = (avg_b + avg_g + avg_r) / 3.0
+
+    if avg_b == 0:
+        avg_b = 1.0
+    if avg_g == 0:
+        avg_g = 1.0
+    if avg_r == 0:
+        avg_r = 1.0
+
+    levels = np.arange(256, dtype=np.float64)
+    luts = np.empty((256, 1, 3), dtype=np.uint8)
+    for channel, avg in enumerate((avg_b, avg_g, avg_r)):
+        luts[:, 0, channel] = np.clip(levels * (avg_gray / avg), 0, 255).astype(np.uint8)
+    return luts
+
+
+def automatic_white_balance(image: np.ndarray, inplace: bool = False) -> np.ndarray:
+    # Gray-world gains applied through per-channel lookup tables: peak extra
+    # memory is one uint8 output frame (none when inplace=True) instead of a
+    # float64 copy plus temporaries, i.e. ~1.1GB less for a 48MP photo.
+    luts = _white_balance_luts(image)
+    if inplace:
+        return cv2.LUT(image, luts, dst=image)
+    return cv2.LUT(image, luts)
+
+
+def analysis_scale() -> int:
+    # Downscale factor for analysis-only decodes; correction output stays full size.
+    scale = env_int("ANALYSIS_SCALE", 1)
+    return scale if scale in ANALYSIS_SCALES else 1
+
+
+def is_jpeg(image_bytes: bytes) -> bool:
+    return bytes(image_bytes[:3]) == b"\xff\xd8\xff"
+
+
+def _shrink(image: np.ndarray, scale: int) -> np.ndarray:
+    h, w = image.shape[:2]
+    size = (max(1, w // scale), max(1, h // scale))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def decode_image(image_bytes: bytes, scale: int = 1) -> np.ndarray:
+    # IMREAD_COLOR (and the REDUCED variants) also apply the EXIF orientation
+    # tag, so decode and orient happen in a single pass.
+    data = np.frombuffer(image_bytes, dtype=np.uint8)
+    reduced_flag = _REDUCED_JPEG_FLAGS.get(scale) if is_jpeg(image_bytes) else None
+    image = cv2.imdecode(data, reduced_flag if reduced_flag is not None else cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image bytes")
+    if scale > 1 and reduced_flag is None:
+        # No DCT shortcut for PNG/WebP: shrink right after decoding so every
+        # later stage works on the small frame.
+        image = _shrink(image, scale)
+    return image
+
+
+# decode -> orient -> AWB -> derived colour spaces, each computed at most once.
+# Correction and both analyses consume a pipeline rather than raw bytes, so one
+# decoded upload can feed all of them, and whether AWB runs is the caller's call.
+class ImagePipeline:
+    def __init__(self, image: np.ndarray, apply_awb: bool = True) -> None:
+        self._image = image
+        self.apply_awb = apply_awb
+        self._balanced = not apply_awb
+        self._hsv: np.ndarray | None = None
+        self._lab: np.ndarray | None = None
+
+    @classmethod
+    def from_bytes(cls, image_bytes: bytes, apply_awb: bool = True, scale: int = 1) -> ImagePipeline:
+        return cls(decode_image(image_bytes, scale=scale), apply_awb=apply_awb)
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return self._image.shape
+
+    @property
+    def corrected(self) -> np.ndarray:
+        if not self._balanced:
+            # The decoded frame is owned by the pipeline, so balance it in
+            # place rather than holding a second full-size copy.
+            automatic_white_balance(self._image, inplace=True)
+            self._balanced = True
+        return self._image
+
+    @property
+    def hsv(self) -> np.ndarray:
+        if self._hsv is None:
+            self._hsv = cv2.cvtColor(self.corrected, cv2.COLOR_BGR2HSV)
+        return self._hsv
+
+    @property
+    def lab(self) -> np.ndarray:
+        if self._lab is None:
+            self._lab = cv2.cvtColor(self.corrected, cv2.COLOR_BGR2Lab)
+        return self._lab
+
+    def downscaled(self, max_edge: int) -> tuple[np.ndarray, float]:
+        # Cheap preview of the corrected frame plus the factor that maps its
+        # coordinates back to full size.
+        image = self.corrected
+        h, w = image.shape[:2]
+        factor = max(h, w) / max_edge if max_edge > 0 else 1.0
+        if factor <= 1.0:
+            return image, 1.0
+        size = (max(1, round(w / factor)), max(1, round(h / factor)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA), factor
+
+    def for_analysis(self, scale: int = 1, apply_awb: bool = False) -> ImagePipeline:
+        # Hands the corrected frame on to an analysis, shrunk like a reduced
+        # decode. A second balance at full scale runs in place, so encode first.
+        image = self.corrected
+        if scale > 1:
+            image = _shrink(image, scale)
+        return ImagePipeline(image, apply_awb=apply_awb)
+
+    def crop(self, x0: int, y0: int, x1: int, y1: int) -> ImagePipeline:
+        # A view over the corrected frame; colour spaces of the crop are only
+        # computed for the pixels inside it.
+        return ImagePipeline(self.corrected[y0:y1, x0:x1], apply_awb=False)
+
+    def encode(self, ext: str) -> bytes:
+        success, encoded = cv2.imencode(ext, self.corrected)
+        if not success:
+            raise ValueError("Failed to encode corrected image")
+        return encoded.tobytes()
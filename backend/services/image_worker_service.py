@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable
+
+from services.env_service import env_float, env_int
+
+DEFAULT_PROCESSES = 2
+DEFAULT_MAX_QUEUE = 8
+DEFAULT_TASK_TIMEOUT = 60.0
+
+
+class ImagePoolBusyError(RuntimeError):
+    pass
+
+
+class ImageTaskTimeoutError(RuntimeError):
+    pass
+
+
+_pool: ProcessPoolExecutor | None = None
+_lock = threading.Lock()
+_pending = 0
+_stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "timed_out": 0, "expired": 0}
+
+
+def _processes() -> int:
+    return env_int("IMAGE_POOL_PROCESSES", DEFAULT_PROCESSES)
+
+
+def _max_queue() -> int:
+    return max(1, env_int("IMAGE_POOL_MAX_QUEUE", DEFAULT_MAX_QUEUE))
+
+
+def _task_timeout() -> float:
+    return env_float("IMAGE_TASK_TIMEOUT", DEFAULT_TASK_TIMEOUT)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=_processes())
+    return _pool
+
+
+def _invoke(fn: Callable[..., Any], shm_name: str, size: int, args: tuple[Any, ...], deadline_at: float) -> Any:
+    # Runs in the worker process. Deadlines are soft: tasks that sat in the
+    # queue past their deadline are dropped before doing any decoding, but a
+    # task that already started runs to completion. The caller stops waiting
+    # at the deadline and answers 504 while the worker finishes in the background.
+    if time.time() > deadline_at:
+        raise ImageTaskTimeoutError("Image task deadline passed before it started")
+    shm = SharedMemory(name=shm_name, track=False)
+    view = shm.buf[:size]
+    try:
+        return fn(view, *args)
+    finally:
+        try:
+            view.release()
+            shm.close()
+        except BufferError:
+            # A traceback still references an array over the buffer; the
+            # mapping goes away with it.
+            pass
+
+
+def pool_enabled() -> bool:
+    return _processes() > 0
+
+
+def is_saturated() -> bool:
+    if not pool_enabled():
+        return False
+    with _lock:
+        return _pending >= _max_queue()
+
+
+def _task_done(shm: SharedMemory, future: Future) -> None:
+    global _pending
+    shm.close()
+    shm.unlink()
+    with _lock:
+        _pending -= 1
+        if future.cancelled():
+            return
+        if future.exception() is None:
+            _stats["completed"] += 1
+        elif isinstance(future.exception(), ImageTaskTimeoutError):
+            _stats["expired"] += 1
+        else:
+            _stats["failed"] += 1
+
+
+def submit_image_task(
+    fn: Callable[..., Any],
+    image_bytes: bytes,
+    *args: Any,
+    timeout: float | None = None,
+) -> Future:
+    # fn must be a module-level function taking a bytes-like buffer first. The
+    # input is copied once into shared memory instead of being pickled through
+    # the executor's pipe; workers read it in place.
+    global _pending
+    if timeout is None:
+        timeout = _task_timeout()
+    with _lock:
+        if _pending >= _max_queue():
+            _stats["rejected"] += 1
+            raise ImagePoolBusyError("Image processing pool is saturated")
+        _pending += 1
+        _stats["submitted"] += 1
+
+    size = len(image_bytes)
+    shm = None
+    try:
+        shm = SharedMemory(create=True, size=max(1, size))
+        shm.buf[:size] = image_bytes
+        future = _submit(_invoke, fn, shm.name, size, args, time.time() + timeout)
+    except Exception:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        with _lock:
+            _pending -= 1
+        raise
+    future.add_done_callback(lambda done: _task_done(shm, done))
+    return future
+
+
+def _submit(*args: Any) -> Future:
+    global _pool
+    with _lock:
+        pool = _get_pool()
+    try:
+        return pool.submit(*args)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM-killed); start a fresh pool once and retry.
+        with _lock:
+            if _pool is pool:
+                _pool = None
+            pool = _get_pool()
+        return pool.submit(*args)
+
+
+def run_image_task(fn: Callable[..., Any], image_bytes: bytes, *args: Any, timeout: float | None = None) -> Any:
+    if not pool_enabled():
+        return fn(image_bytes, *args)
+    if timeout is None:
+        timeout = _task_timeout()
+    future = submit_image_task(fn, image_bytes, *args, timeout=timeout)
+    return wait_image_task(future, timeout)
+
+
+def wait_image_task(future: Future, timeout: float | None = None) -> Any:
+    try:
+        return future.result(timeout=_task_timeout() if timeout is None else timeout)
+    except FutureTimeoutError as exc:
+        future.cancel()
+        with _lock:
+            _stats["timed_out"] += 1
+        raise ImageTaskTimeoutError("Image task exceeded its deadline") from exc
+
+
+async def run_image_task_async(
+    fn: Callable[..., Any],
+    image_bytes: bytes,
+    *args: Any,
+    timeout: float | None = None,
+) -> Any:
+    if timeout is None:
+        timeout = _task_timeout()
+    if not pool_enabled():
+        return await asyncio.to_thread(fn, image_bytes, *args)
+    future = submit_image_task(fn, image_bytes, *args, timeout=timeout)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError as exc:
+        with _lock:
+            _stats["timed_out"] += 1
+        raise ImageTaskTimeoutError("Image task exceeded its deadline") from exc
+
+
+def get_image_pool_stats() -> dict[str, int]:
+    with _lock:
+        stats = dict(_stats)
+        stats["queue_depth"] = _pending
+    stats["max_queue"] = _max_queue()
+    stats["processes"] = max(0, _processes())
+    return stats
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from typing import Any
+
+from services.db_service import get_connection
+from services.env_service import env_flag, env_int
+from services.ttl_cache_service import TTLCache
+
+DEFAULT_CACHE_SIZE = 512
+DEFAULT_CACHE_TTL_SECONDS = 7 * 24 * 3600
+# Bump when the prompt or the quantization changes so old narratives stop matching.
+SIGNATURE_VERSION = 3
+
+
+def narrative_cache_enabled() -> bool:
+    return env_flag("NARRATIVE_CACHE")
+
+
+def _cache_size() -> int:
+    return max(0, env_int("NARRATIVE_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+
+
+def _cache_ttl() -> int:
+    return max(0, env_int("NARRATIVE_CACHE_TTL_SECONDS", DEFAULT_CACHE_TTL_SECONDS))
+
+
+_cache = TTLCache(_cache_size, counters=("bypassed",))
+
+
+def init_narrative_table() -> None:
+    with get_connection() as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS narrative_cache (
+                signature TEXT PRIMARY KEY,
+                narrative TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        conn.commit()
+
+
+def _band(value: Any, width: float, top: int) -> int | None:
+    if value is None:
+        return None
+    return min(int(float(value) // width), top)
+
+
+def narrative_signature(report: dict[str, Any]) -> str:
+    # The narrative only depends on which clinical bucket the scan falls into,
+    # so the key is built from coarse bands rather than raw metrics. Bands are
+    # aligned with the thresholds the analyses already use (coating 10/50%,
+    # redness a* 20/35, Armstrong grades).
+    urine = report.get("urineAnalysis", {})
+    tongue = report.get("tongueAnalysis", {})
+    tongue_metrics = tongue.get("metrics") or {}
+    profile = report.get("userProfile") or {}
+    gender = (profile.get("gender") or "").strip().lower() or None
+    signature = {
+        "v": SIGNATURE_VERSION,
+        "armstrong": (urine.get("analysisData") or {}).get("estimated_armstrong_grade"),
+        "hydration": urine.get("status") or None,
+        "coating": _band(tongue_metrics.get("coating_percentage"), 10, 10),
+        "moisture": _band(tongue_metrics.get("moisture_score"), 5, 12),
+        "redness": _band(tongue_metrics.get("body_redness_a"), 5, 10),
+        "diagnosis": sorted(tongue.get("diagnosis") or []),
+        "age": _band(profile.get("age"), 10, 9),
+        "gender": gender,
+        "drinks": sorted(drink.get("id", "") for drink in report.get("recommendedDrinks", [])),
+    }
+    raw = json.dumps(signature, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def lookup_narrative(signature: str) -> dict[str, Any] | None:
+    ttl = _cache_ttl()
+
+    def load(now: float) -> tuple[dict[str, Any], float] | None:
+        if ttl <= 0:
+            return None
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT narrative, created_at FROM narrative_cache WHERE signature = ? AND created_at > ?",
+                (signature, now - ttl),
+            ).fetchone()
+        if not row:
+            return None
+        return json.loads(row["narrative"]), row["created_at"] + ttl
+
+    return _cache.lookup(signature, load=load)
+
+
+def store_narrative(signature: str, narrative: dict[str, Any]) -> None:
+    ttl = _cache_ttl()
+    if ttl <= 0:
+        return
+    now = time.time()
+    _cache.store(signature, narrative, now + ttl)
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO narrative_cache (signature, narrative, created_at) VALUES (?, ?, ?)",
+            (signature, json.dumps(narrative, ensure_ascii=False), now),
+        )
+        conn.execute("DELETE FROM narrative_cache WHERE created_at <= ?", (now - ttl,))
+        conn.commit()
+
+
+def record_bypass() -> None:
+    _cache.count("bypassed")
+
+
+def get_narrative_cache_stats() -> dict[str, float]:
+    stats = _cache.stats()
+    stats["enabled"] = narrative_cache_enabled()
+    return stats
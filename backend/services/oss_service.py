@@ -1,8 +1,59 @@
 import os
+import threading
+import time
+
 import oss2
 
+from services.env_service import env_float, env_int
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_TIMEOUT_SECONDS = 30.0
+DEFAULT_SIGNED_URL_REFRESH_MARGIN = 300
+OPERATION_TIMEOUT_ENV = {
+    "upload": "OSS_UPLOAD_TIMEOUT",
+    "download": "OSS_DOWNLOAD_TIMEOUT",
+    "list": "OSS_LIST_TIMEOUT",
+    "sign": "OSS_SIGN_TIMEOUT",
+}
+
+_pool_lock = threading.Lock()
+_session: oss2.Session | None = None
+_session_pool_size = 0
+_buckets: dict[tuple[str, ...], oss2.Bucket] = {}
+_pool_stats = {"hits": 0, "misses": 0}
+_signed_url_lock = threading.Lock()
+_signed_urls: dict[tuple[str, ...], tuple[float, str]] = {}
+_signed_url_stats = {"hits": 0, "signed": 0, "refreshed": 0}
+
+
+def _positive_float_env(name: str, default: float) -> float:
+    value = env_float(name, default)
+    return value if value > 0 else default
+
+
+def _pool_size() -> int:
+    return max(1, env_int("OSS_POOL_SIZE", DEFAULT_POOL_SIZE))
+
+
+def _operation_timeout(operation: str) -> float:
+    default = _positive_float_env("OSS_TIMEOUT", DEFAULT_TIMEOUT_SECONDS)
+    env_name = OPERATION_TIMEOUT_ENV.get(operation)
+    if not env_name:
+        return default
+    return _positive_float_env(env_name, default)
+
+
+def _get_session() -> oss2.Session:
+    # One requests.Session per process: urllib3 keeps connections alive and
+    # reuses them across buckets, so only the first call pays for TCP+TLS.
+    global _session, _session_pool_size
+    if _session is None:
+        _session_pool_size = _pool_size()
+        _session = oss2.Session(pool_size=_session_pool_size)
+    return _session
 
-def _get_bucket() -> oss2.Bucket:
+
+def _get_bucket(operation: str = "default") -> oss2.Bucket:
     access_key_id = os.getenv("OSS_ACCESS_KEY_ID", "").strip()
     access_key_secret = os.getenv("OSS_ACCESS_KEY_SECRET", "").strip()
     endpoint = os.getenv("OSS_ENDPOINT", "").strip()
@@ -11,17 +62,79 @@ def _get_bucket() -> oss2.Bucket:
     if not all([access_key_id, access_key_secret, endpoint, bucket_name]):
         raise RuntimeError("OSS configuration is incomplete")
 
-    auth = oss2.Auth(access_key_id, access_key_secret)
-    return oss2.Bucket(auth, endpoint, bucket_name)
+    timeout = _operation_timeout(operation)
+    cache_key = (access_key_id, access_key_secret, endpoint, bucket_name, str(timeout))
+    with _pool_lock:
+        bucket = _buckets.get(cache_key)
+        if bucket is not None:
+            _pool_stats["hits"] += 1
+            return bucket
+        _pool_stats["misses"] += 1
+        session = _get_session()
+        if any(key[:4] != cache_key[:4] for key in _buckets):
+            # Credentials or endpoint rotated; drop buckets bound to the old config.
+            _buckets.clear()
+        auth = oss2.Auth(access_key_id, access_key_secret)
+        bucket = oss2.Bucket(auth, endpoint, bucket_name, session=session, connect_timeout=timeout)
+        _buckets[cache_key] = bucket
+        return bucket
+
+
+def get_pool_stats() -> dict[str, int]:
+    with _pool_lock:
+        return {
+            "hits": _pool_stats["hits"],
+            "misses": _pool_stats["misses"],
+            "buckets": len(_buckets),
+            "pool_size": _session_pool_size or _pool_size(),
+        }
+
+
+class _BufferReader:
+    # oss2 only streams bytes or file objects; this reads a memoryview (e.g. a
+    # spooled upload) in chunks without first materialising it as bytes.
+    def __init__(self, view: memoryview) -> None:
+        self._view = view
+        self._offset = 0
+
+    def __len__(self) -> int:
+        return len(self._view) - self._offset
+
+    def read(self, amt: int | None = None) -> bytes:
+        end = len(self._view) if amt is None or amt < 0 else min(len(self._view), self._offset + amt)
+        chunk = self._view[self._offset:end].tobytes()
+        self._offset = end
+        return chunk
+
+
+def upload_bytes(
+    object_key: str,
+    content: bytes | memoryview,
+    content_type: str,
+    content_encoding: str | None = None,
+) -> str | None:
+    bucket = _get_bucket("upload")
+    data = _BufferReader(content) if isinstance(content, memoryview) else content
+    headers = {"Content-Type": content_type}
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+    result = bucket.put_object(object_key, data, headers=headers)
+    return getattr(result, "etag", None)
+
 
+def copy_object(source_key: str, target_key: str) -> None:
+    # Server-side copy; the object data never passes through this process.
+    bucket = _get_bucket("upload")
+    bucket.copy_object(bucket.bucket_name, source_key, target_key)
 
-def upload_bytes(object_key: str, content: bytes, content_type: str) -> None:
-    bucket = _get_bucket()
-    bucket.put_object(object_key, content, headers={"Content-Type": content_type})
+
+def delete_object(object_key: str) -> None:
+    bucket = _get_bucket("upload")
+    bucket.delete_object(object_key)
 
 
 def download_bytes(object_key: str) -> tuple[bytes, str | None]:
-    bucket = _get_bucket()
+    bucket = _get_bucket("download")
     result = bucket.get_object(object_key)
     content = result.read()
     content_type = None
@@ -30,22 +143,95 @@ def download_bytes(object_key: str) -> tuple[bytes, str | None]:
     return content, content_type
 
 
-def list_report_objects(user_id: str) -> list[dict[str, str]]:
-    bucket = _get_bucket()
-    prefix = f"{user_id}/"
-    reports = []
+def iter_report_objects(prefix: str = ""):
+    bucket = _get_bucket("list")
     for obj in oss2.ObjectIteratorV2(bucket, prefix=prefix):
         key = obj.key
         if key.endswith("/report/report.json"):
-            reports.append(
-                {
-                    "object_key": key,
-                    "last_modified": str(obj.last_modified),
-                }
-            )
-    return reports
+            yield {
+                "object_key": key,
+                "last_modified": str(obj.last_modified),
+            }
+
+
+def download_stored_bytes(object_key: str) -> tuple[bytes, str | None, str | None]:
+    # Returns the object exactly as stored plus its Content-Encoding and ETag.
+    # result.read() would let requests transparently gunzip objects stored with
+    # Content-Encoding: gzip (and then fail oss2's CRC check on the inflated
+    # bytes), so the raw stream is read with decoding turned off.
+    bucket = _get_bucket("download")
+    result = bucket.get_object(object_key)
+    headers = getattr(result, "headers", None) or {}
+    raw = result.resp.response.raw
+    content = raw.read(decode_content=False)
+    return content, headers.get("Content-Encoding"), getattr(result, "etag", None)
+
+
+def list_report_objects(user_id: str) -> list[dict[str, str]]:
+    return list(iter_report_objects(f"{user_id}/"))
+
+
+def list_object_keys(prefix: str) -> list[str]:
+    bucket = _get_bucket("list")
+    return [obj.key for obj in oss2.ObjectIteratorV2(bucket, prefix=prefix)]
 
 
 def get_object_url(object_key: str, expires: int = 3600) -> str:
-    bucket = _get_bucket()
+    bucket = _get_bucket("sign")
     return bucket.sign_url("GET", object_key, expires)
+
+
+def _signed_url_refresh_margin() -> int:
+    return max(0, env_int("SIGNED_URL_REFRESH_MARGIN", DEFAULT_SIGNED_URL_REFRESH_MARGIN))
+
+
+def get_cached_object_url(object_key: str, expires: int = 3600) -> str:
+    # For static objects (drink images) the same signed GET URL is handed out
+    # until it is within the refresh margin of expiring, instead of signing
+    # again for every report. The margin is capped at half the lifetime.
+    cache_key = (
+        os.getenv("OSS_ACCESS_KEY_ID", "").strip(),
+        os.getenv("OSS_ENDPOINT", "").strip(),
+        os.getenv("OSS_BUCKET_NAME", "").strip(),
+        object_key,
+        str(expires),
+    )
+    margin = min(_signed_url_refresh_margin(), expires // 2)
+    now = time.time()
+    with _signed_url_lock:
+        entry = _signed_urls.get(cache_key)
+        if entry is not None and entry[0] - margin > now:
+            _signed_url_stats["hits"] += 1
+            return entry[1]
+    url = get_object_url(object_key, expires)
+    with _signed_url_lock:
+        if any(key[:3] != cache_key[:3] for key in _signed_urls):
+            # Credentials or bucket changed; URLs signed for the old config are useless.
+            _signed_urls.clear()
+        _signed_urls[cache_key] = (now + expires, url)
+        _signed_url_stats["refreshed" if entry is not None else "signed"] += 1
+    return url
+
+
+def get_signed_url_stats() -> dict[str, int]:
+    with _signed_url_lock:
+        stats = dict(_signed_url_stats)
+        stats["entries"] = len(_signed_urls)
+    stats["refresh_margin"] = _signed_url_refresh_margin()
+    return stats
+
+
+def get_upload_url(object_key: str, content_type: str, expires: int = 900) -> str:
+    # The Content-Type is part of the signature, so the client must send the
+    # same header with its PUT.
+    bucket = _get_bucket("sign")
+    return bucket.sign_url("PUT", object_key, expires, headers={"Content-Type": content_type})
+
+
+def head_object(object_key: str) -> dict[str, object] | None:
+    bucket = _get_bucket("download")
+    try:
+        meta = bucket.head_object(object_key)
+    except oss2.exceptions.NotFound:
+        return None
+    return {"size": meta.content_length, "content_type": meta.content_type, "etag": meta.etag}
@@ -1,9 +1,45 @@
+import asyncio
 import base64
 import json
 import os
-from typing import Any
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import re
+from typing import Any, Callable, Iterator, TypeVar
 
-from openai import OpenAI
+import cv2
+import httpx
+import numpy as np
+from openai import APIConnectionError, APIStatusError, APITimeoutError, OpenAI
+
+from services.env_service import env_float, env_int
+from services.narrative_cache_service import narrative_cache_enabled
+
+DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+DEFAULT_CLASSIFY_CONCURRENCY = 8
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 60.0
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_RETRY_BASE_DELAY = 0.5
+DEFAULT_RETRY_MAX_DELAY = 8.0
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_COOLDOWN = 30.0
+DEFAULT_VLM_MAX_EDGE = 1024
+DEFAULT_VLM_QUALITY = 85
+VLM_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+NO_API_KEY_REASON = "DASHSCOPE_API_KEY not set"
+INVALID_RESPONSE_REASON = "Model response was not valid JSON"
+UNCACHEABLE_REASONS = {NO_API_KEY_REASON, INVALID_RESPONSE_REASON}
+
+T = TypeVar("T")
 
 PROMPT = (
     "Determine if the image shows (A) a close-up human tongue or "
@@ -13,20 +49,256 @@ PROMPT = (
 
 REPORT_PROMPT = (
     "You are a hydration analysis assistant. Given report inputs as JSON, "
-    "generate short, clinically cautious text. Use urineAnalysis.metrics and "
-    "urineAnalysis.analysisData to write urineInsight, urineStatus, and urineColorLevel. "
-    "Use tongueAnalysis.metrics and tongueAnalysis.diagnosis to write tongueInsight and tongueStatus. "
-    "Choose the best drink from report.recommendedDrinks and return drinkId and drinkReason. "
-    "Use userProfile "
+    "generate short, clinically cautious text. Use urine.metrics and "
+    "urine.analysis to write urineInsight. "
+    "Use tongue.metrics and tongue.diagnosis to write tongueInsight and tongueStatus. "
+    "summary holds the computed hydration level and status; keep the text consistent with them. "
+    "Choose the best drink from drinks (id: benefit) and return its id as drinkId and drinkReason. "
+    "Use profile "
     "(age, gender, height_cm, weight_kg) to personalize the tone and advice. "
     "Reply ONLY with JSON containing keys: "
-    '"hydrationSummaryLevel", "hydrationSummaryStatus", "hydrationSummaryWellnessTip", '
-    '"urineInsight", "urineStatus", "urineColorLevel", '
+    '"hydrationSummaryWellnessTip", "urineInsight", '
     '"tongueInsight", "tongueStatus", "drinkId", "drinkReason". '
     "The urineInsight should be a very detailed, clinically cautious text. "
     "Explain what each metric means and how it affects the insight. "
     "Write the insights in markdown format for readability. The tongueInsight must be markdown."
 )
+# Rough chars-per-token for the English/JSON prompt; only used for the
+# before/after comparison in /metrics, not for any limit.
+CHARS_PER_TOKEN = 4
+
+
+class QwenUnavailableError(RuntimeError):
+    pass
+
+
+class _CircuitBreaker:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        cooldown = env_float("QWEN_BREAKER_COOLDOWN", DEFAULT_BREAKER_COOLDOWN)
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < cooldown or self._trial_in_flight:
+                return False
+            # Half-open: let a single request probe whether DashScope recovered.
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        threshold = max(1, env_int("QWEN_BREAKER_THRESHOLD", DEFAULT_BREAKER_THRESHOLD))
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= threshold:
+                self._opened_at = time.monotonic()
+
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if self._trial_in_flight else "open"
+
+
+_client: OpenAI | None = None
+_client_api_key = ""
+_client_lock = threading.Lock()
+_breaker = _CircuitBreaker()
+_hedge_executor: ThreadPoolExecutor | None = None
+_stats_lock = threading.Lock()
+_client_stats = {"calls": 0, "retries": 0, "failures": 0, "hedges": 0, "hedge_wins": 0, "rejected": 0}
+
+
+def _bump(name: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _client_stats[name] += amount
+
+
+def _get_client(api_key: str) -> OpenAI:
+    # One client per process so the httpx pool keeps DashScope connections warm.
+    global _client, _client_api_key
+    with _client_lock:
+        if _client is None or _client_api_key != api_key:
+            if _client is not None:
+                _client.close()
+            timeout = httpx.Timeout(
+                env_float("QWEN_READ_TIMEOUT", DEFAULT_READ_TIMEOUT),
+                connect=env_float("QWEN_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+            )
+            max_connections = max(1, env_int("QWEN_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS))
+            limits = httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=env_float("QWEN_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY),
+            )
+            _client = OpenAI(
+                api_key=api_key,
+                base_url=DASHSCOPE_BASE_URL,
+                timeout=timeout,
+                max_retries=0,
+                http_client=httpx.Client(timeout=timeout, limits=limits),
+            )
+            _client_api_key = api_key
+        return _client
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    with _client_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=max(2, env_int("QWEN_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)),
+                thread_name_prefix="qwen-hedge",
+            )
+        return _hedge_executor
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (APIConnectionError, APITimeoutError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+def _hedged(request: Callable[[], T]) -> T:
+    hedge_after = env_float("QWEN_HEDGE_AFTER_SECONDS", 0.0)
+    if hedge_after <= 0:
+        return request()
+
+    executor = _get_hedge_executor()
+    primary = executor.submit(request)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result()
+
+    _bump("hedges")
+    hedge = executor.submit(request)
+    pending = {primary, hedge}
+    error: BaseException | None = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    _bump("hedge_wins")
+                # The slower duplicate finishes in the background; its result is dropped.
+                return future.result()
+            error = future.exception()
+    assert error is not None
+    raise error
+
+
+def _call_with_resilience(request: Callable[[], T], hedge: bool = True) -> T:
+    if not _breaker.allow():
+        _bump("rejected")
+        raise QwenUnavailableError("DashScope is unavailable (circuit open)")
+
+    max_retries = max(0, env_int("QWEN_MAX_RETRIES", DEFAULT_MAX_RETRIES))
+    base_delay = env_float("QWEN_RETRY_BASE_DELAY", DEFAULT_RETRY_BASE_DELAY)
+    max_delay = env_float("QWEN_RETRY_MAX_DELAY", DEFAULT_RETRY_MAX_DELAY)
+    _bump("calls")
+    attempt = 0
+    while True:
+        try:
+            result = _hedged(request) if hedge else request()
+        except Exception as exc:
+            if not _is_retryable(exc):
+                _breaker.record_success()
+                raise
+            if attempt >= max_retries:
+                _bump("failures")
+                _breaker.record_failure()
+                raise
+            _bump("retries")
+            # Full jitter keeps retrying workers from synchronising on a struggling upstream.
+            time.sleep(random.uniform(0, min(max_delay, base_delay * (2**attempt))))
+            attempt += 1
+            continue
+        _breaker.record_success()
+        return result
+
+
+def get_client_stats() -> dict[str, object]:
+    with _stats_lock:
+        stats: dict[str, object] = dict(_client_stats)
+    stats["breaker"] = _breaker.state()
+    return stats
+
+
+_classify_stats_lock = threading.Lock()
+_classify_stats = {
+    "images": 0,
+    "preprocessed": 0,
+    "bytes_in": 0,
+    "bytes_sent": 0,
+    "raw_latency_ms_total": 0.0,
+    "raw_calls": 0,
+    "preprocessed_latency_ms_total": 0.0,
+    "preprocessed_calls": 0,
+}
+
+
+def prepare_image_for_vlm(image_bytes: bytes, mime_type: str) -> tuple[bytes, str, bool]:
+    # A tongue-vs-urine decision needs nothing close to the full camera
+    # resolution; re-encoding also drops EXIF/GPS metadata from the payload.
+    max_edge = env_int("QWEN_IMAGE_MAX_EDGE", DEFAULT_VLM_MAX_EDGE)
+    if max_edge <= 0:
+        return image_bytes, mime_type, False
+    fmt = os.getenv("QWEN_IMAGE_FORMAT", "jpeg").strip().lower()
+    ext, out_mime, quality_flag = VLM_FORMATS.get(fmt, VLM_FORMATS["jpeg"])
+    quality = min(100, max(1, env_int("QWEN_IMAGE_QUALITY", DEFAULT_VLM_QUALITY)))
+
+    # imdecode raises (rather than returning None) on an empty buffer.
+    if len(image_bytes) == 0:
+        return image_bytes, mime_type, False
+    try:
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except cv2.error:
+        image = None
+    if image is None:
+        return image_bytes, mime_type, False
+    h, w = image.shape[:2]
+    scale = max_edge / max(h, w)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    success, encoded = cv2.imencode(ext, image, [quality_flag, quality])
+    if not success or encoded.nbytes >= len(image_bytes):
+        return image_bytes, mime_type, False
+    return encoded.tobytes(), out_mime, True
+
+
+def _record_classification(bytes_in: int, bytes_sent: int, preprocessed: bool, elapsed_ms: float) -> None:
+    mode = "preprocessed" if preprocessed else "raw"
+    with _classify_stats_lock:
+        _classify_stats["images"] += 1
+        _classify_stats["bytes_in"] += bytes_in
+        _classify_stats["bytes_sent"] += bytes_sent
+        if preprocessed:
+            _classify_stats["preprocessed"] += 1
+        _classify_stats[f"{mode}_latency_ms_total"] += elapsed_ms
+        _classify_stats[f"{mode}_calls"] += 1
+
+
+def get_classify_stats() -> dict[str, float]:
+    with _classify_stats_lock:
+        stats = dict(_classify_stats)
+    stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_sent"]
+    for mode in ("raw", "preprocessed"):
+        calls = stats[f"{mode}_calls"]
+        stats[f"{mode}_latency_ms_avg"] = round(stats[f"{mode}_latency_ms_total"] / calls, 1) if calls else 0.0
+    return stats
 
 
 def _extract_json(text: str) -> dict[str, Any]:
@@ -42,36 +314,46 @@ def _extract_json(text: str) -> dict[str, Any]:
     return json.loads(text[start : end + 1])
 
 
-def classify_image(image_bytes: bytes, mime_type: str) -> dict[str, str]:
+def classify_image(image_bytes: bytes, mime_type: str, preprocess: bool = True) -> dict[str, str]:
     api_key = os.getenv("DASHSCOPE_API_KEY", "").strip()
     if not api_key:
-        return {"label": "other", "reason": "DASHSCOPE_API_KEY not set"}
+        return {"label": "other", "reason": NO_API_KEY_REASON}
 
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    )
+    client = _get_client(api_key)
 
-    data_url = f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
-    completion = client.chat.completions.create(
-        model="qwen-vl-plus",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image_url", "image_url": {"url": data_url}},
-                    {"type": "text", "text": PROMPT},
-                ],
-            }
-        ],
-        temperature=0,
+    started = time.perf_counter()
+    if preprocess:
+        payload, payload_mime, preprocessed = prepare_image_for_vlm(image_bytes, mime_type)
+    else:
+        payload, payload_mime, preprocessed = image_bytes, mime_type, False
+    data_url = f"data:{payload_mime};base64,{base64.b64encode(payload).decode('utf-8')}"
+    completion = _call_with_resilience(
+        lambda: client.chat.completions.create(
+            model="qwen-vl-plus",
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "image_url", "image_url": {"url": data_url}},
+                        {"type": "text", "text": PROMPT},
+                    ],
+                }
+            ],
+            temperature=0,
+        )
+    )
+    _record_classification(
+        len(image_bytes),
+        len(payload),
+        preprocessed,
+        (time.perf_counter() - started) * 1000,
     )
 
     content = completion.choices[0].message.content or ""
     try:
         parsed = _extract_json(content)
     except Exception:
-        return {"label": "other", "reason": "Model response was not valid JSON"}
+        return {"label": "other", "reason": INVALID_RESPONSE_REASON}
 
     label = str(parsed.get("label", "other")).lower()
     reason = str(parsed.get("reason", "Unclear image"))
@@ -80,42 +362,213 @@ def classify_image(image_bytes: bytes, mime_type: str) -> dict[str, str]:
     return {"label": label, "reason": reason}
 
 
-def generate_report_text(report_data: dict[str, Any]) -> dict[str, str] | None:
-    api_key = os.getenv("DASHSCOPE_API_KEY", "").strip()
-    if not api_key:
-        return None
+_classify_executor: ThreadPoolExecutor | None = None
+_classify_executor_lock = threading.Lock()
+
+
+def _get_classify_executor() -> ThreadPoolExecutor:
+    global _classify_executor
+    with _classify_executor_lock:
+        if _classify_executor is None:
+            _classify_executor = ThreadPoolExecutor(
+                max_workers=max(1, env_int("QWEN_CLASSIFY_CONCURRENCY", DEFAULT_CLASSIFY_CONCURRENCY)),
+                thread_name_prefix="qwen-classify",
+            )
+        return _classify_executor
 
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+
+async def classify_image_async(image_bytes: bytes, mime_type: str) -> dict[str, str]:
+    # The DashScope call blocks for seconds; run it on a dedicated, bounded
+    # executor so the event loop keeps serving other requests meanwhile and
+    # excess classifications queue instead of exhausting the shared threadpool.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_classify_executor(), classify_image, image_bytes, mime_type)
+
+
+# Hydration level/status and the urine status/colour are computed from the
+# metrics; the model only writes the prose around them.
+REPORT_TEXT_FIELDS = (
+    "hydrationSummaryWellnessTip",
+    "urineInsight",
+    "tongueInsight",
+    "tongueStatus",
+    "drinkId",
+    "drinkReason",
+)
+_report_prompt_lock = threading.Lock()
+_report_prompt_stats = {
+    "prompts": 0,
+    "full_tokens_est": 0,
+    "compact_tokens_est": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+}
+
+_FIELD_PATTERN = re.compile(
+    r'"(' + "|".join(REPORT_TEXT_FIELDS) + r')"\s*:\s*("(?:[^"\\]|\\.)*"|(?:-?\d+(?:\.\d+)?|null)(?=\s*[,}]))'
+)
+
+
+def _compact(value: Any) -> Any:
+    if isinstance(value, dict):
+        items = ((key, _compact(item)) for key, item in value.items())
+        return {key: item for key, item in items if item not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [_compact(item) for item in value]
+    return value
+
+
+def report_prompt_input(report_data: dict[str, Any]) -> dict[str, Any]:
+    # Only what the narrative depends on: no signed drink URLs, display copy,
+    # placeholders or test date.
+    urine = report_data.get("urineAnalysis", {})
+    tongue = report_data.get("tongueAnalysis", {})
+    summary = report_data.get("hydrationSummary", {})
+    return _compact(
+        {
+            "urine": {"metrics": urine.get("metrics"), "analysis": urine.get("analysisData")},
+            "tongue": {"metrics": tongue.get("metrics"), "diagnosis": tongue.get("diagnosis")},
+            "summary": {"level": summary.get("level"), "status": summary.get("status")},
+            "profile": report_data.get("userProfile"),
+            "drinks": {
+                drink["id"]: drink.get("benefit", "")
+                for drink in report_data.get("recommendedDrinks", [])
+                if drink.get("id")
+            },
+        }
     )
 
-    completion = client.chat.completions.create(
-        model="qwen-plus",
-        messages=[
-            {
-                "role": "user",
-                "content": f"{REPORT_PROMPT}\n\nINPUT_JSON:\n{json.dumps(report_data)}",
-            }
-        ],
-        temperature=0.2,
+
+def _length_budget_instruction() -> str:
+    words = env_int("REPORT_INSIGHT_MAX_WORDS", 0)
+    if words <= 0:
+        return ""
+    return f" Keep urineInsight and tongueInsight under {words} words each and every other value to one sentence."
+
+
+def _reuse_instruction() -> str:
+    # Cached text is shown for other reports in the same bands, so it must
+    # not quote this report's exact readings.
+    if not narrative_cache_enabled():
+        return ""
+    return (
+        " Do not quote numeric metric values anywhere in the text; describe them qualitatively"
+        " (e.g. 'fairly concentrated', 'a moderate coating') so the wording fits similar results."
     )
 
-    content = completion.choices[0].message.content or ""
+
+def _report_messages(report_data: dict[str, Any]) -> list[dict[str, str]]:
+    payload = json.dumps(report_prompt_input(report_data), ensure_ascii=False, separators=(",", ":"))
+    content = f"{REPORT_PROMPT}{_length_budget_instruction()}{_reuse_instruction()}\n\nINPUT_JSON:\n{payload}"
+    _record_report_prompt(report_data, content)
+    return [{"role": "user", "content": content}]
+
+
+def _report_request_options() -> dict[str, Any]:
+    max_tokens = env_int("REPORT_MAX_TOKENS", 0)
+    return {"max_tokens": max_tokens} if max_tokens > 0 else {}
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _record_report_prompt(report_data: dict[str, Any], content: str) -> None:
+    # Compare against what the previous full-report prompt would have cost.
+    full = f"{REPORT_PROMPT}\n\nINPUT_JSON:\n{json.dumps(report_data)}"
+    with _report_prompt_lock:
+        _report_prompt_stats["prompts"] += 1
+        _report_prompt_stats["full_tokens_est"] += _estimate_tokens(full)
+        _report_prompt_stats["compact_tokens_est"] += _estimate_tokens(content)
+
+
+def _record_report_usage(completion: Any) -> None:
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return
+    with _report_prompt_lock:
+        _report_prompt_stats["prompt_tokens"] += usage.prompt_tokens or 0
+        _report_prompt_stats["completion_tokens"] += usage.completion_tokens or 0
+
+
+def get_report_prompt_stats() -> dict[str, float]:
+    with _report_prompt_lock:
+        stats: dict[str, float] = dict(_report_prompt_stats)
+    prompts = stats["prompts"]
+    stats["full_tokens_est_avg"] = round(stats["full_tokens_est"] / prompts, 1) if prompts else 0.0
+    stats["compact_tokens_est_avg"] = round(stats["compact_tokens_est"] / prompts, 1) if prompts else 0.0
+    stats["max_tokens"] = env_int("REPORT_MAX_TOKENS", 0)
+    return stats
+
+
+def parse_report_text(content: str) -> dict[str, str] | None:
     try:
         parsed = _extract_json(content)
     except Exception:
         return None
 
-    return {
-        "hydrationSummaryLevel": parsed.get("hydrationSummaryLevel"),
-        "hydrationSummaryStatus": str(parsed.get("hydrationSummaryStatus", "")),
-        "hydrationSummaryWellnessTip": str(parsed.get("hydrationSummaryWellnessTip", "")),
-        "urineInsight": str(parsed.get("urineInsight", "")),
-        "urineStatus": str(parsed.get("urineStatus", "")),
-        "urineColorLevel": str(parsed.get("urineColorLevel", "")),
-        "tongueInsight": str(parsed.get("tongueInsight", "")),
-        "tongueStatus": str(parsed.get("tongueStatus", "")),
-        "drinkId": str(parsed.get("drinkId", "")),
-        "drinkReason": str(parsed.get("drinkReason", "")),
-    }
+    return {name: str(parsed.get(name, "")) for name in REPORT_TEXT_FIELDS}
+
+
+def completed_report_fields(partial: str) -> dict[str, Any]:
+    # Fields whose JSON value has fully arrived in a partially streamed reply.
+    fields = {}
+    for match in _FIELD_PATTERN.finditer(partial):
+        try:
+            fields[match.group(1)] = json.loads(match.group(2))
+        except ValueError:
+            continue
+    return fields
+
+
+def generate_report_text(report_data: dict[str, Any]) -> dict[str, str] | None:
+    api_key = os.getenv("DASHSCOPE_API_KEY", "").strip()
+    if not api_key:
+        return None
+
+    client = _get_client(api_key)
+    messages = _report_messages(report_data)
+
+    try:
+        completion = _call_with_resilience(
+            lambda: client.chat.completions.create(
+                model="qwen-plus",
+                messages=messages,
+                temperature=0.2,
+                **_report_request_options(),
+            )
+        )
+    except QwenUnavailableError:
+        return None
+
+    _record_report_usage(completion)
+    return parse_report_text(completion.choices[0].message.content or "")
+
+
+def stream_report_text(report_data: dict[str, Any]) -> Iterator[str]:
+    api_key = os.getenv("DASHSCOPE_API_KEY", "").strip()
+    if not api_key:
+        return
+
+    client = _get_client(api_key)
+    messages = _report_messages(report_data)
+
+    try:
+        # Retries only cover opening the stream; hedging a stream would double-bill tokens.
+        stream = _call_with_resilience(
+            lambda: client.chat.completions.create(
+                model="qwen-plus",
+                messages=messages,
+                temperature=0.2,
+                stream=True,
+                **_report_request_options(),
+            ),
+            hedge=False,
+        )
+    except QwenUnavailableError:
+        return
+
+    with stream:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple
+
+from services.env_service import env_int
+from services.oss_service import download_stored_bytes, head_object
+
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+DEFAULT_DISK_CACHE_BYTES = 256 * 1024 * 1024
+DEFAULT_REVALIDATE_SECONDS = 300
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class CachedReport(NamedTuple):
+    etag: str
+    content: bytes
+    checked_at: float
+    content_encoding: str | None = None
+
+
+_lock = threading.Lock()
+_entries: OrderedDict[str, CachedReport] = OrderedDict()
+_total_bytes = 0
+# Running size of REPORT_CACHE_DIR as seen by this process; None until the
+# first write measures it. Other workers writing to the same directory make
+# it drift low, which the rescan on the next overflow corrects.
+_disk_bytes: int | None = None
+_stats = {
+    "memory_hits": 0,
+    "disk_hits": 0,
+    "misses": 0,
+    "revalidated": 0,
+    "refetched": 0,
+    "not_modified": 0,
+    "disk_evictions": 0,
+}
+_size_stats = {
+    "stored_reports": 0,
+    "stored_bytes": 0,
+    "stored_bytes_raw": 0,
+    "served_bytes": 0,
+    "served_bytes_raw": 0,
+    "served_compressed": 0,
+    "served_decompressed": 0,
+}
+
+
+def _max_bytes() -> int:
+    return max(0, env_int("REPORT_CACHE_BYTES", DEFAULT_CACHE_BYTES))
+
+
+def _max_disk_bytes() -> int:
+    return max(0, env_int("REPORT_CACHE_DIR_BYTES", DEFAULT_DISK_CACHE_BYTES))
+
+
+def _revalidate_after() -> int:
+    return max(0, env_int("REPORT_CACHE_REVALIDATE_SECONDS", DEFAULT_REVALIDATE_SECONDS))
+
+
+def _disk_dir() -> Path | None:
+    raw = os.getenv("REPORT_CACHE_DIR", "").strip()
+    return Path(raw) if raw else None
+
+
+def _compression() -> str:
+    value = os.getenv("REPORT_COMPRESSION", "gzip").strip().lower()
+    return value if value in {"gzip", "none"} else "gzip"
+
+
+def _encoding_of(content: bytes) -> str | None:
+    # Older reports were stored as plain JSON; the gzip magic settles it even
+    # when the Content-Encoding metadata is missing or wrong.
+    return "gzip" if content[:2] == GZIP_MAGIC else None
+
+
+def encode_report(raw: bytes) -> tuple[bytes, str | None]:
+    if _compression() == "gzip":
+        # mtime=0 keeps the output (and thus the ETag) stable for equal reports.
+        stored, encoding = gzip.compress(raw, compresslevel=6, mtime=0), "gzip"
+    else:
+        stored, encoding = raw, None
+    with _lock:
+        _size_stats["stored_reports"] += 1
+        _size_stats["stored_bytes"] += len(stored)
+        _size_stats["stored_bytes_raw"] += len(raw)
+    return stored, encoding
+
+
+def _accepts_gzip(accept_encoding: str | None) -> bool:
+    # An explicit gzip entry wins over "*"; q=0 means "not acceptable".
+    qualities: dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        coding, *params = [item.strip() for item in part.split(";")]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    quality = qualities.get("gzip", qualities.get("*", 0.0))
+    return quality > 0
+
+
+def report_body(entry: CachedReport, accept_encoding: str | None) -> tuple[bytes, str | None]:
+    # Pass compressed bytes straight through when the client can take them;
+    # otherwise inflate here.
+    content, encoding = entry.content, entry.content_encoding
+    if encoding == "gzip":
+        raw_size = None
+        if not _accepts_gzip(accept_encoding):
+            content = gzip.decompress(content)
+            raw_size, encoding = len(content), None
+        with _lock:
+            if encoding == "gzip":
+                _size_stats["served_compressed"] += 1
+            else:
+                _size_stats["served_decompressed"] += 1
+            _size_stats["served_bytes"] += len(content)
+            # The inflated size is only known when we had to decompress; the
+            # gzip trailer records it otherwise (mod 2**32, ample for reports).
+            _size_stats["served_bytes_raw"] += raw_size or int.from_bytes(entry.content[-4:], "little")
+        return content, encoding
+    with _lock:
+        _size_stats["served_bytes"] += len(content)
+        _size_stats["served_bytes_raw"] += len(content)
+    return content, encoding
+
+
+def _disk_path(directory: Path, object_key: str) -> Path:
+    return directory / f"{hashlib.sha256(object_key.encode('utf-8')).hexdigest()}.report"
+
+
+def _remember(object_key: str, entry: CachedReport) -> None:
+    global _total_bytes
+    limit = _max_bytes()
+    with _lock:
+        previous = _entries.pop(object_key, None)
+        if previous is not None:
+            _total_bytes -= len(previous.content)
+        if len(entry.content) > limit:
+            return
+        _entries[object_key] = entry
+        _total_bytes += len(entry.content)
+        while _total_bytes > limit and _entries:
+            _, evicted = _entries.popitem(last=False)
+            _total_bytes -= len(evicted.content)
+
+
+def _write_disk(object_key: str, entry: CachedReport) -> None:
+    directory = _disk_dir()
+    if directory is None:
+        return
+    # First line holds the ETag; the rest is the report exactly as stored.
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        path = _disk_path(directory, object_key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        data = entry.etag.encode("utf-8") + b"\n" + entry.content
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        return
+    _prune_disk(directory, len(data))
+
+
+def _prune_disk(directory: Path, added: int) -> None:
+    # Same byte budget idea as the memory tier, evicting by oldest write time.
+    global _disk_bytes
+    limit = _max_disk_bytes()
+    with _lock:
+        if _disk_bytes is not None:
+            _disk_bytes += added
+            if _disk_bytes <= limit:
+                return
+    files = []
+    for path in directory.glob("*.report"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    evicted = 0
+    for _, size, path in sorted(files):
+        if total <= limit:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= size
+        evicted += 1
+    with _lock:
+        _disk_bytes = total
+        _stats["disk_evictions"] += evicted
+
+
+def _read_disk(object_key: str) -> CachedReport | None:
+    directory = _disk_dir()
+    if directory is None:
+        return None
+    path = _disk_path(directory, object_key)
+    try:
+        raw = path.read_bytes()
+        checked_at = path.stat().st_mtime
+    except OSError:
+        return None
+    etag, _, content = raw.partition(b"\n")
+    if not etag:
+        return None
+    return CachedReport(etag.decode("utf-8"), content, checked_at, _encoding_of(content))
+
+
+def store_report(object_key: str, etag: str | None, content: bytes, content_encoding: str | None = None) -> None:
+    # Write-through from the report writer so a fresh report is served
+    # without a round trip to OSS.
+    if not etag:
+        invalidate_report(object_key)
+        return
+    entry = CachedReport(etag, content, time.time(), content_encoding)
+    _remember(object_key, entry)
+    _write_disk(object_key, entry)
+
+
+def invalidate_report(object_key: str) -> None:
+    global _total_bytes
+    with _lock:
+        previous = _entries.pop(object_key, None)
+        if previous is not None:
+            _total_bytes -= len(previous.content)
+    directory = _disk_dir()
+    if directory is not None:
+        try:
+            _disk_path(directory, object_key).unlink()
+        except OSError:
+            pass
+
+
+def _fetch(object_key: str) -> CachedReport:
+    content, _, etag = download_stored_bytes(object_key)
+    entry = CachedReport(
+        etag or hashlib.md5(content).hexdigest().upper(),
+        content,
+        time.time(),
+        _encoding_of(content),
+    )
+    _remember(object_key, entry)
+    _write_disk(object_key, entry)
+    return entry
+
+
+def get_report(object_key: str) -> CachedReport:
+    with _lock:
+        entry = _entries.get(object_key)
+        if entry is not None:
+            _entries.move_to_end(object_key)
+            _stats["memory_hits"] += 1
+    if entry is None:
+        entry = _read_disk(object_key)
+        if entry is not None:
+            with _lock:
+                _stats["disk_hits"] += 1
+            _remember(object_key, entry)
+    if entry is None:
+        with _lock:
+            _stats["misses"] += 1
+        return _fetch(object_key)
+
+    if time.time() - entry.checked_at < _revalidate_after():
+        return entry
+    # Reports can be regenerated under the same key, so after the TTL a HEAD
+    # confirms the ETag before the cached bytes are trusted again.
+    head = head_object(object_key)
+    if head is not None and head.get("etag") == entry.etag:
+        with _lock:
+            _stats["revalidated"] += 1
+        entry = entry._replace(checked_at=time.time())
+        _remember(object_key, entry)
+        return entry
+    with _lock:
+        _stats["refetched"] += 1
+    invalidate_report(object_key)
+    return _fetch(object_key)
+
+
+def record_not_modified() -> None:
+    with _lock:
+        _stats["not_modified"] += 1
+
+
+def get_report_cache_stats() -> dict[str, int]:
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = len(_entries)
+        stats["bytes"] = _total_bytes
+        stats["disk_bytes"] = _disk_bytes or 0
+    stats["max_bytes"] = _max_bytes()
+    stats["max_disk_bytes"] = _max_disk_bytes()
+    return stats
+
+
+def get_report_size_stats() -> dict[str, int]:
+    with _lock:
+        stats = dict(_size_stats)
+    stats["stored_bytes_saved"] = stats["stored_bytes_raw"] - stats["stored_bytes"]
+    stats["egress_bytes_saved"] = stats["served_bytes_raw"] - stats["served_bytes"]
+    return stats
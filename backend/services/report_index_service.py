@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import argparse
+import base64
+import binascii
+import time
+
+from services.db_service import BASE_DIR, get_connection
+from services.oss_service import iter_report_objects
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def init_reports_table() -> None:
+    with get_connection() as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reports (
+                user_id TEXT NOT NULL,
+                test_id TEXT NOT NULL,
+                object_key TEXT NOT NULL,
+                last_modified INTEGER NOT NULL,
+                PRIMARY KEY (user_id, test_id)
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS reports_by_user_date
+            ON reports (user_id, last_modified DESC, test_id DESC)
+            """
+        )
+        conn.commit()
+
+
+def record_report(user_id: str, test_id: str, object_key: str, last_modified: int | None = None) -> None:
+    if last_modified is None:
+        last_modified = int(time.time())
+    with get_connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO reports (user_id, test_id, object_key, last_modified)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, test_id) DO UPDATE SET
+                object_key = excluded.object_key,
+                last_modified = MAX(reports.last_modified, excluded.last_modified)
+            """,
+            (user_id, test_id, object_key, last_modified),
+        )
+        conn.commit()
+
+
+def _encode_cursor(last_modified: int, test_id: str) -> str:
+    raw = f"{last_modified}:{test_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[int, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        last_modified, test_id = raw.split(":", 1)
+        return int(last_modified), test_id
+    except (binascii.Error, UnicodeDecodeError, ValueError) as exc:
+        raise InvalidCursorError("Invalid cursor") from exc
+
+
+def list_reports(
+    user_id: str,
+    cursor: str | None = None,
+    limit: int | None = DEFAULT_PAGE_SIZE,
+) -> tuple[list[dict[str, str]], str | None]:
+    # Newest first; the cursor is the (last_modified, test_id) of the last row
+    # returned, so pages stay stable while new reports are added. limit=None
+    # returns every row (the unpaged response older clients expect).
+    if limit is not None:
+        limit = min(max(1, limit), MAX_PAGE_SIZE)
+    query = "SELECT test_id, object_key, last_modified FROM reports WHERE user_id = ?"
+    params: list[object] = [user_id]
+    if cursor:
+        last_modified, test_id = _decode_cursor(cursor)
+        query += " AND (last_modified < ? OR (last_modified = ? AND test_id < ?))"
+        params += [last_modified, last_modified, test_id]
+    query += " ORDER BY last_modified DESC, test_id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit + 1)
+    with get_connection() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1]["last_modified"], rows[-1]["test_id"])
+    items = [
+        {"object_key": row["object_key"], "last_modified": str(row["last_modified"])}
+        for row in rows
+    ]
+    return items, next_cursor
+
+
+def backfill_from_oss(prefix: str = "") -> int:
+    init_reports_table()
+    count = 0
+    for item in iter_report_objects(prefix):
+        parts = item["object_key"].split("/")
+        if len(parts) != 4:
+            continue
+        record_report(parts[0], parts[1], item["object_key"], int(float(item["last_modified"])))
+        count += 1
+    return count
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Build the reports index from report objects already in OSS.")
+    parser.add_argument("--user", help="only backfill this user_id")
+    args = parser.parse_args(argv)
+    count = backfill_from_oss(f"{args.user}/" if args.user else "")
+    print(f"indexed {count} reports")
+    return 0
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv(BASE_DIR.parent / ".env")
+    raise SystemExit(main())
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from services.env_service import env_int
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_QUEUE = 100
+DEFAULT_RETENTION_SECONDS = 3600
+LATENCY_WINDOW = 200
+
+
+class ReportQueueFullError(RuntimeError):
+    pass
+
+
+class ReportJob:
+    def __init__(self, job_id: str, dedupe_key: str) -> None:
+        self.job_id = job_id
+        self.dedupe_key = dedupe_key
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.result: Any = None
+        self.error: str | None = None
+        self.done = threading.Event()
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "object_key": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+_lock = threading.Lock()
+_jobs: dict[str, ReportJob] = {}
+_active: dict[str, str] = {}
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+_stats = {"submitted": 0, "coalesced": 0, "succeeded": 0, "failed": 0, "rejected": 0}
+_queue_waits: deque[float] = deque(maxlen=LATENCY_WINDOW)
+_latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, env_int("REPORT_JOB_WORKERS", DEFAULT_WORKERS)),
+                thread_name_prefix="report-job",
+            )
+        return _executor
+
+
+def _prune(now: float) -> None:
+    retention = env_int("REPORT_JOB_RETENTION_SECONDS", DEFAULT_RETENTION_SECONDS)
+    expired = [
+        job_id
+        for job_id, job in _jobs.items()
+        if job.finished_at is not None and now - job.finished_at > retention
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+def _queue_depth() -> int:
+    return sum(1 for job in _jobs.values() if job.status == "queued")
+
+
+def _run(job: ReportJob, fn: Callable[..., Any], args: tuple[Any, ...]) -> None:
+    with _lock:
+        job.status = "running"
+        job.started_at = time.time()
+        _queue_waits.append(job.started_at - job.created_at)
+    try:
+        result = fn(*args)
+    except Exception as exc:
+        with _lock:
+            job.status = "failed"
+            job.error = str(exc) or exc.__class__.__name__
+            _stats["failed"] += 1
+    else:
+        with _lock:
+            job.status = "succeeded"
+            job.result = result
+            _stats["succeeded"] += 1
+    finally:
+        with _lock:
+            job.finished_at = time.time()
+            _latencies.append(job.finished_at - job.created_at)
+            if _active.get(job.dedupe_key) == job.job_id:
+                del _active[job.dedupe_key]
+        job.done.set()
+
+
+def submit_job(dedupe_key: str, fn: Callable[..., Any], *args: Any) -> tuple[ReportJob, bool]:
+    with _lock:
+        now = time.time()
+        _prune(now)
+        active_id = _active.get(dedupe_key)
+        if active_id is not None:
+            # The same test is already queued or running; hand back that job.
+            _stats["coalesced"] += 1
+            return _jobs[active_id], True
+        if _queue_depth() >= max(1, env_int("REPORT_JOB_MAX_QUEUE", DEFAULT_MAX_QUEUE)):
+            _stats["rejected"] += 1
+            raise ReportQueueFullError("Report queue is full")
+        job = ReportJob(secrets.token_urlsafe(12), dedupe_key)
+        _jobs[job.job_id] = job
+        _active[dedupe_key] = job.job_id
+        _stats["submitted"] += 1
+    _get_executor().submit(_run, job, fn, args)
+    return job, False
+
+
+def get_job(job_id: str) -> ReportJob | None:
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return round(ordered[index] * 1000, 1)
+
+
+def get_job_stats() -> dict[str, Any]:
+    with _lock:
+        stats: dict[str, Any] = dict(_stats)
+        stats["queue_depth"] = _queue_depth()
+        stats["running"] = sum(1 for job in _jobs.values() if job.status == "running")
+        waits = list(_queue_waits)
+        latencies = list(_latencies)
+    stats["queue_wait_ms_p50"] = _percentile(waits, 0.5)
+    stats["latency_ms_p50"] = _percentile(latencies, 0.5)
+    stats["latency_ms_p95"] = _percentile(latencies, 0.95)
+    return stats
@@ -1,13 +1,69 @@
 from __future__ import annotations
 
+from collections import deque
+from concurrent.futures import Future
 from datetime import datetime
 import os
+import threading
+import time
 from typing import Any
 
+from services.env_service import env_flag
 from services.qwen_service import generate_report_text
-from services.urine_analysis_service import analyze_urine_hydration_bytes
+from services.narrative_cache_service import (
+    lookup_narrative,
+    narrative_cache_enabled,
+    narrative_signature,
+    record_bypass,
+    store_narrative,
+)
+from services.color_correction_service import correct_image
+from services.image_pipeline_service import ImagePipeline, analysis_scale
+from services.urine_analysis_service import analyze_urine_hydration, analyze_urine_hydration_bytes
 from services.tongue_analysis_service import analyze_tongue_health_bytes
-from services.oss_service import get_object_url
+from services.oss_service import get_cached_object_url
+from services.image_worker_service import (
+    ImageTaskTimeoutError,
+    pool_enabled,
+    submit_image_task,
+    wait_image_task,
+)
+
+
+TIMING_WINDOW = 200
+
+_timing_lock = threading.Lock()
+_stage_timings: dict[str, deque[float]] = {}
+_timed_reports = 0
+
+
+def _record_stage(timings: dict[str, float] | None, stage: str, started: float) -> None:
+    if timings is not None:
+        timings[stage] = round((time.perf_counter() - started) * 1000, 1)
+
+
+def record_report_timings(timings: dict[str, float]) -> None:
+    global _timed_reports
+    with _timing_lock:
+        _timed_reports += 1
+        for stage, value in timings.items():
+            _stage_timings.setdefault(stage, deque(maxlen=TIMING_WINDOW)).append(value)
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def get_report_timing_stats() -> dict[str, Any]:
+    # Per-stage p50/p95 in ms over the last TIMING_WINDOW reports.
+    with _timing_lock:
+        stats: dict[str, Any] = {"reports": _timed_reports}
+        samples = {stage: list(values) for stage, values in _stage_timings.items()}
+    for stage, values in samples.items():
+        stats[f"{stage}_ms_p50"] = _percentile(values, 0.5)
+        stats[f"{stage}_ms_p95"] = _percentile(values, 0.95)
+    return stats
 
 
 def _today_label() -> str:
@@ -92,8 +148,12 @@ def _compute_hydration_summary(report: dict[str, Any]) -> None:
 
 def _build_drink_url(filename: str) -> str:
     object_key = f"drinks/{filename}"
+    # Drink images are static, so a public/CDN origin can serve them without signing.
+    asset_base = os.getenv("DRINK_ASSET_BASE_URL", "").strip().rstrip("/")
+    if asset_base:
+        return f"{asset_base}/{object_key}"
     try:
-        return get_object_url(object_key)
+        return get_cached_object_url(object_key)
     except Exception:
         bucket = os.getenv("OSS_BUCKET_NAME", "").strip()
         endpoint = os.getenv("OSS_ENDPOINT", "").strip()
@@ -163,8 +223,39 @@ def build_base_report(test_date: str | None = None) -> dict[str, Any]:
     }
 
 
-def _apply_urine_analysis(report: dict[str, Any], urine_bytes: bytes) -> None:
-    results = analyze_urine_hydration_bytes(urine_bytes)
+def _reapply_awb_to_corrected() -> bool:
+    return env_flag("URINE_REAPPLY_AWB", True)
+
+
+def analyze_scan(image_bytes: bytes, scan_type: str, corrected: bool = False) -> dict[str, Any]:
+    if scan_type == "urine":
+        # The stored corrected copy was already white-balanced at upload; a second
+        # gray-world pass is kept by default for metric continuity but can be skipped.
+        apply_awb = not corrected or _reapply_awb_to_corrected()
+        return analyze_urine_hydration_bytes(image_bytes, apply_awb=apply_awb)
+    if scan_type == "tongue":
+        return analyze_tongue_health_bytes(image_bytes)
+    raise ValueError(f"Unknown scan type: {scan_type}")
+
+
+def correct_and_analyze_urine(
+    image_bytes: bytes,
+    object_key: str,
+    content_type: str | None,
+    analyze: bool = True,
+) -> tuple[bytes, str, str, dict[str, Any] | None]:
+    # One worker task, one decode: the balanced frame is encoded for storage and
+    # then analysed the same way analyze_scan treats the stored corrected copy.
+    pipeline = ImagePipeline.from_bytes(image_bytes)
+    corrected_bytes, content_type, ext = correct_image(pipeline, object_key, content_type)
+    results = None
+    if analyze:
+        analysis = pipeline.for_analysis(analysis_scale(), apply_awb=_reapply_awb_to_corrected())
+        results = analyze_urine_hydration(analysis)
+    return corrected_bytes, content_type, ext, results
+
+
+def _apply_urine_analysis(report: dict[str, Any], results: dict[str, Any]) -> None:
     metrics = results["metrics"]
     analysis = results["analysis"]
 
@@ -183,68 +274,156 @@ def _apply_urine_analysis(report: dict[str, Any], urine_bytes: bytes) -> None:
     )
 
 
-def create_report_payload(
+def _submit_analysis(scan_type: str, image_bytes: bytes, corrected: bool) -> Future | None:
+    if not pool_enabled():
+        return None
+    return submit_image_task(analyze_scan, image_bytes, scan_type, corrected)
+
+
+def _collect_analysis(
+    scan_type: str,
+    image_bytes: bytes,
+    corrected: bool,
+    future: Future | None,
+) -> dict[str, Any] | None:
+    if future is not None:
+        # Deadline and saturation errors propagate so the API can answer 503/504.
+        try:
+            return wait_image_task(future)
+        except ImageTaskTimeoutError:
+            raise
+        except Exception:
+            return None
+    try:
+        return analyze_scan(image_bytes, scan_type, corrected=corrected)
+    except Exception:
+        return None
+
+
+def build_deterministic_report(
     test_date: str | None = None,
     urine_bytes: bytes | None = None,
     tongue_bytes: bytes | None = None,
     user_profile: dict[str, Any] | None = None,
+    urine_corrected: bool = False,
+    urine_results: dict[str, Any] | None = None,
+    tongue_results: dict[str, Any] | None = None,
+    timings: dict[str, float] | None = None,
 ) -> dict[str, Any]:
+    started = time.perf_counter()
+    pending: dict[str, Future | None] = {}
+    if urine_results is None and urine_bytes:
+        pending["urine"] = _submit_analysis("urine", urine_bytes, urine_corrected)
+    if tongue_results is None and tongue_bytes:
+        pending["tongue"] = _submit_analysis("tongue", tongue_bytes, False)
+
+    # Signing the drink URLs overlaps with the CV work running in the pool.
     report = build_base_report(test_date=test_date)
     if user_profile:
         report["userProfile"].update(user_profile)
-    if urine_bytes:
-        try:
-            _apply_urine_analysis(report, urine_bytes)
-        except Exception:
-            pass
-    if tongue_bytes:
+    _record_stage(timings, "base_report", started)
+
+    # Only the wait for results; the pool started on them before base_report.
+    analysis_started = time.perf_counter()
+    if "urine" in pending:
+        urine_results = _collect_analysis("urine", urine_bytes, urine_corrected, pending["urine"])
+    if "tongue" in pending:
+        tongue_results = _collect_analysis("tongue", tongue_bytes, False, pending["tongue"])
+    if pending:
+        _record_stage(timings, "analysis", analysis_started)
+
+    if urine_results:
         try:
-            results = analyze_tongue_health_bytes(tongue_bytes)
-            report["tongueAnalysis"]["metrics"] = results.get("metrics", {})
-            report["tongueAnalysis"]["diagnosis"] = results.get("diagnosis", [])
+            _apply_urine_analysis(report, urine_results)
         except Exception:
             pass
+    if tongue_results:
+        report["tongueAnalysis"]["metrics"] = tongue_results.get("metrics", {})
+        report["tongueAnalysis"]["diagnosis"] = tongue_results.get("diagnosis", [])
     _compute_hydration_summary(report)
-    generated = generate_report_text(report)
-    if generated:
-        level = generated.get("hydrationSummaryLevel", report["hydrationSummary"]["level"])
-        status = generated.get("hydrationSummaryStatus", report["hydrationSummary"]["status"])
-        tip = generated.get("hydrationSummaryWellnessTip", report["hydrationSummary"]["wellnessTip"])
-        if level is not None:
-            report["hydrationSummary"]["level"] = level
-        if status:
-            report["hydrationSummary"]["status"] = status
-        if tip:
-            report["hydrationSummary"]["wellnessTip"] = tip
-        report["urineAnalysis"]["insight"] = generated.get(
-            "urineInsight", report["urineAnalysis"]["insight"]
-        )
-        report["urineAnalysis"]["status"] = generated.get(
-            "urineStatus", report["urineAnalysis"]["status"]
-        )
-        report["urineAnalysis"]["colorLevel"] = generated.get(
-            "urineColorLevel", report["urineAnalysis"]["colorLevel"]
-        )
-        if report["urineAnalysis"]["analysis"] and report["urineAnalysis"]["analysis"] not in report["urineAnalysis"]["insight"]:
-            report["urineAnalysis"]["insight"] = (
-                f"{report['urineAnalysis']['insight']} {report['urineAnalysis']['analysis']}".strip()
-            )
-        report["urineAnalysis"]["analysis"] = ""
-        report["tongueAnalysis"]["insight"] = generated.get(
-            "tongueInsight", report["tongueAnalysis"]["insight"]
-        )
-        report["tongueAnalysis"]["status"] = generated.get(
-            "tongueStatus", report["tongueAnalysis"]["status"]
+    return report
+
+
+def apply_generated_text(report: dict[str, Any], generated: dict[str, Any] | None) -> None:
+    if not generated:
+        return
+    # Level, status and colour stay as computed from the metrics, whether the
+    # text is fresh or comes from the narrative cache.
+    tip = generated.get("hydrationSummaryWellnessTip", report["hydrationSummary"]["wellnessTip"])
+    if tip:
+        report["hydrationSummary"]["wellnessTip"] = tip
+    report["urineAnalysis"]["insight"] = generated.get(
+        "urineInsight", report["urineAnalysis"]["insight"]
+    )
+    if report["urineAnalysis"]["analysis"] and report["urineAnalysis"]["analysis"] not in report["urineAnalysis"]["insight"]:
+        report["urineAnalysis"]["insight"] = (
+            f"{report['urineAnalysis']['insight']} {report['urineAnalysis']['analysis']}".strip()
         )
-        selected_id = generated.get("drinkId", "")
-        reason = generated.get("drinkReason", "")
-        if selected_id:
-            for drink in report["recommendedDrinks"]:
-                is_best = drink["id"] == selected_id
-                drink["isBest"] = is_best
-                if is_best:
-                    drink["reason"] = reason or drink.get("reason", "")
-        if not any(drink.get("isBest") for drink in report["recommendedDrinks"]):
-            report["recommendedDrinks"][0]["isBest"] = True
-        report["recommendedDrinks"] = [drink for drink in report["recommendedDrinks"] if drink.get("isBest")]
+    report["urineAnalysis"]["analysis"] = ""
+    report["tongueAnalysis"]["insight"] = generated.get(
+        "tongueInsight", report["tongueAnalysis"]["insight"]
+    )
+    report["tongueAnalysis"]["status"] = generated.get(
+        "tongueStatus", report["tongueAnalysis"]["status"]
+    )
+    selected_id = generated.get("drinkId", "")
+    reason = generated.get("drinkReason", "")
+    if selected_id:
+        for drink in report["recommendedDrinks"]:
+            is_best = drink["id"] == selected_id
+            drink["isBest"] = is_best
+            if is_best:
+                drink["reason"] = reason or drink.get("reason", "")
+    if not any(drink.get("isBest") for drink in report["recommendedDrinks"]):
+        report["recommendedDrinks"][0]["isBest"] = True
+    report["recommendedDrinks"] = [drink for drink in report["recommendedDrinks"] if drink.get("isBest")]
+
+
+def lookup_cached_narrative(
+    report: dict[str, Any],
+    fresh: bool = False,
+) -> tuple[str | None, dict[str, Any] | None]:
+    # Must run on the deterministic report, before generated text is applied.
+    if not narrative_cache_enabled():
+        return None, None
+    signature = narrative_signature(report)
+    if fresh:
+        record_bypass()
+        return signature, None
+    return signature, lookup_narrative(signature)
+
+
+def remember_narrative(signature: str | None, generated: dict[str, Any] | None) -> None:
+    if signature and generated:
+        store_narrative(signature, generated)
+
+
+def create_report_payload(
+    test_date: str | None = None,
+    urine_bytes: bytes | None = None,
+    tongue_bytes: bytes | None = None,
+    user_profile: dict[str, Any] | None = None,
+    urine_corrected: bool = False,
+    urine_results: dict[str, Any] | None = None,
+    tongue_results: dict[str, Any] | None = None,
+    timings: dict[str, float] | None = None,
+    fresh_narrative: bool = False,
+) -> dict[str, Any]:
+    report = build_deterministic_report(
+        test_date=test_date,
+        urine_bytes=urine_bytes,
+        tongue_bytes=tongue_bytes,
+        user_profile=user_profile,
+        urine_corrected=urine_corrected,
+        urine_results=urine_results,
+        tongue_results=tongue_results,
+        timings=timings,
+    )
+    started = time.perf_counter()
+    signature, generated = lookup_cached_narrative(report, fresh_narrative)
+    if generated is None:
+        generated = generate_report_text(report)
+        remember_narrative(signature, generated)
+    apply_generated_text(report, generated)
+    _record_stage(timings, "llm", started)
     return report
@@ -3,22 +3,22 @@ from __future__ import annotations
 import cv2
 import numpy as np
 
-from services.color_correction_service import automatic_white_balance
+from services.env_service import env_int
+from services.image_pipeline_service import ImagePipeline, analysis_scale
 
 
-def _decode_image(image_bytes: bytes) -> np.ndarray:
-    data = np.frombuffer(image_bytes, dtype=np.uint8)
-    image = cv2.imdecode(data, cv2.IMREAD_COLOR)
-    if image is None:
-        raise ValueError("Could not decode image bytes")
-    return image
+DEFAULT_LOCATE_MAX_EDGE = 512
+# Extra border kept around the located tongue so the 5x5 open/close sees the
+# same neighbourhood it would on the full frame.
+ROI_PADDING_FRACTION = 0.05
+ROI_MIN_PADDING = 16
 
 
-def analyze_tongue_health_bytes(image_bytes: bytes) -> dict[str, object]:
-    img = _decode_image(image_bytes)
-    corrected = automatic_white_balance(img)
+def _locate_max_edge() -> int:
+    return env_int("TONGUE_LOCATE_MAX_EDGE", DEFAULT_LOCATE_MAX_EDGE)
 
-    hsv = cv2.cvtColor(corrected, cv2.COLOR_BGR2HSV)
+
+def _tongue_mask(hsv: np.ndarray) -> tuple[np.ndarray, np.ndarray | None]:
     lower_red1 = np.array([0, 50, 50])
     upper_red1 = np.array([10, 255, 255])
     lower_red2 = np.array([160, 50, 50])
@@ -37,10 +37,46 @@ def analyze_tongue_health_bytes(image_bytes: bytes) -> dict[str, object]:
     tongue_mask = cv2.morphologyEx(tongue_mask, cv2.MORPH_CLOSE, kernel)
 
     contours, _ = cv2.findContours(tongue_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    largest = None
     if contours:
         largest = max(contours, key=cv2.contourArea)
         tongue_mask = np.zeros_like(tongue_mask)
         cv2.drawContours(tongue_mask, [largest], -1, 255, -1)
+    return tongue_mask, largest
+
+
+def _locate_tongue(pipeline: ImagePipeline, max_edge: int) -> tuple[int, int, int, int] | None:
+    # Find the tongue on a small preview, then return its padded bounding box
+    # in full-size coordinates. None means "analyse the whole frame".
+    if max_edge <= 0:
+        return None
+    preview, factor = pipeline.downscaled(max_edge)
+    if factor <= 1.0:
+        return None
+    _, largest = _tongue_mask(cv2.cvtColor(preview, cv2.COLOR_BGR2HSV))
+    if largest is None:
+        return None
+
+    x, y, w, h = cv2.boundingRect(largest)
+    full_h, full_w = pipeline.shape[:2]
+    pad_x = max(ROI_MIN_PADDING, int(full_w * ROI_PADDING_FRACTION))
+    pad_y = max(ROI_MIN_PADDING, int(full_h * ROI_PADDING_FRACTION))
+    x0 = max(0, int(x * factor) - pad_x)
+    y0 = max(0, int(y * factor) - pad_y)
+    x1 = min(full_w, int((x + w) * factor) + pad_x)
+    y1 = min(full_h, int((y + h) * factor) + pad_y)
+    return x0, y0, x1, y1
+
+
+def analyze_tongue_health(pipeline: ImagePipeline, locate_max_edge: int | None = None) -> dict[str, object]:
+    if locate_max_edge is None:
+        locate_max_edge = _locate_max_edge()
+    roi = _locate_tongue(pipeline, locate_max_edge)
+    if roi is not None:
+        pipeline = pipeline.crop(*roi)
+
+    hsv = pipeline.hsv
+    tongue_mask, _ = _tongue_mask(hsv)
 
     total_tongue_pixels = cv2.countNonZero(tongue_mask)
     if total_tongue_pixels == 0:
@@ -58,7 +94,7 @@ def analyze_tongue_health_bytes(image_bytes: bytes) -> dict[str, object]:
     if cv2.countNonZero(body_mask) == 0:
         body_mask = tongue_mask
 
-    lab_img = cv2.cvtColor(corrected, cv2.COLOR_BGR2Lab)
+    lab_img = pipeline.lab
     mean_val = cv2.mean(lab_img, mask=body_mask)
     l_cv, a_cv, b_cv = mean_val[:3]
 
@@ -93,3 +129,13 @@ def analyze_tongue_health_bytes(image_bytes: bytes) -> dict[str, object]:
         },
         "diagnosis": diagnosis,
     }
+
+
+def analyze_tongue_health_bytes(
+    image_bytes: bytes,
+    scale: int | None = None,
+    locate_max_edge: int | None = None,
+) -> dict[str, object]:
+    if scale is None:
+        scale = analysis_scale()
+    return analyze_tongue_health(ImagePipeline.from_bytes(image_bytes, scale=scale), locate_max_edge)
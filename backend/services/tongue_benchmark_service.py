@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any
+
+from services.tongue_analysis_service import DEFAULT_LOCATE_MAX_EDGE, analyze_tongue_health_bytes
+
+# Metrics that drive the report text; the ROI path should leave them unchanged.
+COMPARED_METRICS = ("coating_percentage", "moisture_score", "body_redness_a")
+
+
+def _run(image_bytes: bytes, locate_max_edge: int, repeats: int) -> dict[str, Any]:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = analyze_tongue_health_bytes(image_bytes, scale=1, locate_max_edge=locate_max_edge)
+        timings.append((time.perf_counter() - started) * 1000)
+    # Separate traced run: tracemalloc slows the call down. OpenCV hands its
+    # outputs back as numpy arrays, which tracemalloc sees; scratch buffers
+    # inside single cv2 calls are not counted.
+    tracemalloc.start()
+    try:
+        analyze_tongue_health_bytes(image_bytes, scale=1, locate_max_edge=locate_max_edge)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "ms_p50": round(statistics.median(timings), 1),
+        "ms_min": round(min(timings), 1),
+        "peak_mb": round(peak / (1024 * 1024), 1),
+        "metrics": result["metrics"],
+    }
+
+
+def compare_roi(image_bytes: bytes, locate_max_edge: int = DEFAULT_LOCATE_MAX_EDGE, repeats: int = 5) -> dict[str, Any]:
+    # A locate edge of 0 analyses the whole frame, as before the ROI pipeline.
+    full = _run(image_bytes, 0, repeats)
+    roi = _run(image_bytes, locate_max_edge, repeats)
+    row: dict[str, Any] = {}
+    for name in ("ms_p50", "ms_min", "peak_mb"):
+        row[f"full_{name}"] = full[name]
+        row[f"roi_{name}"] = roi[name]
+    row["speedup"] = round(full["ms_p50"] / roi["ms_p50"], 2) if roi["ms_p50"] else None
+    for name in COMPARED_METRICS:
+        row[f"{name}_drift"] = round(abs(roi["metrics"][name] - full["metrics"][name]), 2)
+    return row
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Compare latency and peak memory of ROI-restricted tongue analysis against the full frame.",
+    )
+    parser.add_argument("tongue", nargs="+", type=Path, help="tongue sample images")
+    parser.add_argument("--locate-max-edge", type=int, default=DEFAULT_LOCATE_MAX_EDGE)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args(argv)
+    if args.locate_max_edge <= 0:
+        parser.error("--locate-max-edge must be positive; 0 is the full-frame baseline")
+    if args.repeats < 1:
+        parser.error("--repeats must be at least 1")
+
+    rows = []
+    for path in args.tongue:
+        try:
+            row = compare_roi(path.read_bytes(), args.locate_max_edge, args.repeats)
+        except (OSError, ValueError) as exc:
+            print(f"{path}: skipped ({exc})", file=sys.stderr)
+            continue
+        rows.append(row)
+        print(json.dumps({"file": str(path), **row}))
+
+    if not rows:
+        print("no image could be analysed; nothing to compare", file=sys.stderr)
+        return 1
+    full_ms = statistics.median(row["full_ms_p50"] for row in rows)
+    roi_ms = statistics.median(row["roi_ms_p50"] for row in rows)
+    full_mb = max(row["full_peak_mb"] for row in rows)
+    roi_mb = max(row["roi_peak_mb"] for row in rows)
+    print(
+        f"{len(rows)} images: median {full_ms:.1f}ms -> {roi_ms:.1f}ms, "
+        f"worst peak {full_mb:.1f}MB -> {roi_mb:.1f}MB"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
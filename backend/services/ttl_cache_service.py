@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+# (value, expires_at) from a persistent tier, or None when it has no live row.
+Loader = Callable[[float], tuple[dict[str, Any], float] | None]
+
+
+class TTLCache:
+    # In-memory LRU with per-entry expiry in front of an optional persistent
+    # (SQLite) tier: memory -> optional near-match scan -> loader -> miss.
+    # Hit/miss counters follow the same names in every cache so /metrics reads
+    # alike; callers can add their own counters through count().
+    def __init__(self, max_entries: Callable[[], int], counters: tuple[str, ...] = ()) -> None:
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, dict[str, Any], Any]] = OrderedDict()
+        self._stats = dict.fromkeys(("memory_hits", "sqlite_hits", "misses", "stores", *counters), 0)
+
+    def lookup(
+        self,
+        key: str,
+        load: Loader | None = None,
+        near: Callable[[Any], bool] | None = None,
+        near_counter: str = "near_duplicate_hits",
+    ) -> dict[str, Any] | None:
+        # near is tested against the tag stored with each live entry (e.g. a
+        # perceptual hash), newest first, when the exact key is not cached.
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value, _ = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return dict(value)
+                del self._entries[key]
+            if near is not None:
+                for other_key, (expires_at, value, tag) in reversed(self._entries.items()):
+                    if tag is None or expires_at <= now or not near(tag):
+                        continue
+                    self._entries.move_to_end(other_key)
+                    self._stats[near_counter] += 1
+                    return dict(value)
+
+        loaded = load(now) if load is not None else None
+        if loaded is not None:
+            value, expires_at = loaded
+            self.remember(key, value, expires_at)
+            self.count("sqlite_hits")
+            return dict(value)
+
+        self.count("misses")
+        return None
+
+    def remember(self, key: str, value: dict[str, Any], expires_at: float, tag: Any = None) -> None:
+        size = self._max_entries()
+        if size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (expires_at, dict(value), tag)
+            self._entries.move_to_end(key)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def store(self, key: str, value: dict[str, Any], expires_at: float, tag: Any = None) -> None:
+        self.remember(key, value, expires_at, tag)
+        self.count("stores")
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            stats: dict[str, float] = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        hits = sum(value for name, value in stats.items() if name.endswith("_hits"))
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 3) if lookups else 0.0
+        return stats
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import mmap
+import os
+from typing import IO, Any
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Room for multipart boundaries and the small form fields around the file.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(RuntimeError):
+    pass
+
+
+class UploadSpool:
+    # Read-only view over the part Starlette has already spooled for an
+    # UploadFile: the BytesIO buffer while it is small, an mmap of the temp
+    # file once it rolled over to disk. The upload is never copied again.
+    def __init__(self, spooled: IO[bytes]) -> None:
+        self._spooled = spooled
+        self._mmap: mmap.mmap | None = None
+        self._view: memoryview | None = None
+        self._sha256: str | None = None
+
+    def _backing(self) -> Any:
+        # SpooledTemporaryFile keeps its BytesIO / TemporaryFile in _file and
+        # has no public accessor for it.
+        return getattr(self._spooled, "_file", self._spooled)
+
+    @property
+    def on_disk(self) -> bool:
+        return not isinstance(self._backing(), io.BytesIO)
+
+    @property
+    def view(self) -> memoryview:
+        if self._view is None:
+            backing = self._backing()
+            if isinstance(backing, io.BytesIO):
+                self._view = backing.getbuffer()
+            else:
+                backing.flush()
+                if os.fstat(backing.fileno()).st_size == 0:
+                    # mmap refuses empty files.
+                    self._view = memoryview(b"")
+                else:
+                    self._mmap = mmap.mmap(backing.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._view = memoryview(self._mmap)
+        return self._view
+
+    @property
+    def size(self) -> int:
+        return len(self.view)
+
+    @property
+    def sha256(self) -> str:
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.view).hexdigest()
+        return self._sha256
+
+    def close(self) -> None:
+        # Must run before the UploadFile itself is closed: a BytesIO cannot be
+        # closed while its buffer is exported.
+        try:
+            if self._view is not None:
+                self._view.release()
+            if self._mmap is not None:
+                self._mmap.close()
+        except BufferError:
+            # A worker thread still holds an array over the buffer (e.g. a
+            # cancelled request); it is freed when that reference goes away.
+            pass
+        self._view = None
+        self._mmap = None
+
+
+async def ingest_upload(file: UploadFile, max_bytes: int) -> UploadSpool:
+    # UploadSizeLimitMiddleware already stopped oversized bodies while they
+    # streamed in; this is the exact per-file check plus the content hash,
+    # taken in a worker thread so large files don't stall the event loop.
+    spool = UploadSpool(file.file)
+    try:
+        if spool.size > max_bytes:
+            raise UploadTooLargeError("Upload exceeds the size limit")
+        await run_in_threadpool(lambda: spool.sha256)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+class UploadSizeLimitMiddleware:
+    # Rejects oversized upload requests while the body is still arriving, so
+    # the multipart parser never spools more than the limit.
+    def __init__(self, app: ASGIApp, paths: set[str], max_body_bytes: int, detail: str) -> None:
+        self.app = app
+        self.paths = paths
+        self.max_body_bytes = max_body_bytes + MULTIPART_OVERHEAD_BYTES
+        self.detail = detail
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_body_bytes:
+                response = JSONResponse({"detail": self.detail}, status_code=413, headers={"Connection": "close"})
+                await response(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # FastAPI re-raises HTTPExceptions from body parsing as-is,
+                    # so this surfaces as a normal 413 response.
+                    raise HTTPException(status_code=413, detail=self.detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
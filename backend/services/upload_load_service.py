@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import mimetypes
+import statistics
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+DEFAULT_URL = "http://127.0.0.1:8000"
+DEFAULT_LEVELS = (1, 2, 4, 8)
+
+
+def _unique_payload(image_bytes: bytes, mime_type: str, tag: str) -> bytes:
+    # Repeating one sample would only measure the classification cache after
+    # the first request. JPEG and PNG decoders ignore bytes after the end
+    # marker, so a trailer gives every request its own content hash.
+    if mime_type in {"image/jpeg", "image/png"}:
+        return image_bytes + tag.encode("ascii")
+    return image_bytes
+
+
+async def _upload(
+    client: httpx.AsyncClient,
+    limiter: asyncio.Semaphore,
+    sample: tuple[str, bytes, str, str],
+    user_id: str,
+    test_id: str,
+) -> tuple[float, str]:
+    scan_type, image_bytes, mime_type, filename = sample
+    payload = _unique_payload(image_bytes, mime_type, test_id)
+    async with limiter:
+        started = time.perf_counter()
+        try:
+            response = await client.post(
+                "/upload-image",
+                files={"file": (filename, payload, mime_type)},
+                data={"user_id": user_id, "test_id": test_id, "scan_type": scan_type},
+            )
+            outcome = str(response.status_code)
+        except httpx.HTTPError as exc:
+            outcome = type(exc).__name__
+        return (time.perf_counter() - started) * 1000, outcome
+
+
+async def run_level(
+    url: str,
+    samples: list[tuple[str, bytes, str, str]],
+    concurrency: int,
+    requests: int,
+    user_id: str,
+    timeout: float,
+) -> dict[str, Any]:
+    limiter = asyncio.Semaphore(concurrency)
+    run_id = f"{int(time.time())}-c{concurrency}"
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(
+                _upload(client, limiter, samples[i % len(samples)], user_id, f"load-{run_id}-{i}")
+                for i in range(requests)
+            )
+        )
+        elapsed = time.perf_counter() - started
+    latencies = sorted(ms for ms, _ in results)
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "uploads_per_s": round(requests / elapsed, 2),
+        "ms_p50": round(statistics.median(latencies), 1),
+        "ms_p95": round(latencies[int(0.95 * (len(latencies) - 1))], 1),
+        "outcomes": dict(Counter(outcome for _, outcome in results)),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Measure /upload-image throughput of a running backend at increasing concurrency.",
+    )
+    parser.add_argument("--url", default=DEFAULT_URL, help="backend base URL")
+    parser.add_argument("--urine", nargs="*", default=[], type=Path, help="urine sample images")
+    parser.add_argument("--tongue", nargs="*", default=[], type=Path, help="tongue sample images")
+    parser.add_argument(
+        "--concurrency",
+        default=",".join(str(level) for level in DEFAULT_LEVELS),
+        help="comma-separated numbers of uploads in flight",
+    )
+    parser.add_argument("--requests", type=int, default=16, help="uploads per concurrency level")
+    parser.add_argument("--user-id", default="loadtest", help="uploads are stored under this user")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    args = parser.parse_args(argv)
+    if not args.urine and not args.tongue:
+        parser.error("pass at least one --urine or --tongue image")
+    try:
+        levels = sorted({int(level) for level in args.concurrency.split(",") if level.strip()})
+    except ValueError:
+        parser.error("--concurrency must be a comma-separated list of integers")
+    if not levels or levels[0] < 1 or args.requests < 1:
+        parser.error("--concurrency and --requests must be at least 1")
+
+    samples = []
+    for scan_type, paths in (("urine", args.urine), ("tongue", args.tongue)):
+        for path in paths:
+            try:
+                image_bytes = path.read_bytes()
+            except OSError as exc:
+                print(f"{path}: skipped ({exc})", file=sys.stderr)
+                continue
+            samples.append((scan_type, image_bytes, mimetypes.guess_type(path.name)[0] or "image/jpeg", path.name))
+    if not samples:
+        print("no sample could be read; nothing to upload", file=sys.stderr)
+        return 1
+
+    rows = []
+    for concurrency in levels:
+        row = asyncio.run(run_level(args.url, samples, concurrency, args.requests, args.user_id, args.timeout))
+        rows.append(row)
+        print(json.dumps(row))
+
+    baseline = rows[0]["uploads_per_s"]
+    for row in rows[1:]:
+        scaling = row["uploads_per_s"] / baseline if baseline else 0.0
+        print(f"concurrency {row['concurrency']}: {scaling:.2f}x the throughput of concurrency {rows[0]['concurrency']}")
+    failed = sum(count for row in rows for outcome, count in row["outcomes"].items() if outcome != "200")
+    if failed:
+        print(f"{failed} uploads did not return 200; see outcomes", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,22 +1,12 @@
 from __future__ import annotations
 
 import cv2
-import numpy as np
 
-from services.color_correction_service import automatic_white_balance
+from services.image_pipeline_service import ImagePipeline, analysis_scale
 
 
-def _decode_image(image_bytes: bytes) -> np.ndarray:
-    data = np.frombuffer(image_bytes, dtype=np.uint8)
-    image = cv2.imdecode(data, cv2.IMREAD_COLOR)
-    if image is None:
-        raise ValueError("Could not decode image bytes")
-    return image
-
-
-def analyze_urine_hydration_bytes(image_bytes: bytes) -> dict[str, dict[str, object]]:
-    img = _decode_image(image_bytes)
-    corrected = automatic_white_balance(img)
+def analyze_urine_hydration(pipeline: ImagePipeline) -> dict[str, dict[str, object]]:
+    corrected = pipeline.corrected
 
     h, w, _ = corrected.shape
     center_y, center_x = h // 2, w // 2
@@ -76,3 +66,13 @@ def analyze_urine_hydration_bytes(image_bytes: bytes) -> dict[str, dict[str, obj
             "predicted_usg_threshold": usg_prediction,
         },
     }
+
+
+def analyze_urine_hydration_bytes(
+    image_bytes: bytes,
+    apply_awb: bool = True,
+    scale: int | None = None,
+) -> dict[str, dict[str, object]]:
+    if scale is None:
+        scale = analysis_scale()
+    return analyze_urine_hydration(ImagePipeline.from_bytes(image_bytes, apply_awb=apply_awb, scale=scale))